@@ -82,7 +82,8 @@ class Store(object):
 
     def get_request_token(self, request, oauth_request, request_token_key):
         """
-        Return the Token for `request_token_key` or raise `InvalidTokenError`.
+        Return the Token for `request_token_key` or raise `InvalidTokenError`
+        if it doesn't exist or has expired.
 
         `request`: The Django request object.
         `oauth_request`: The `oauth2.Request` object.
@@ -114,7 +115,8 @@ class Store(object):
 
     def get_access_token(self, request, oauth_request, consumer, access_token_key):
         """
-        Return the Token for `access_token_key` or raise `InvalidTokenError`.
+        Return the Token for `access_token_key` or raise `InvalidTokenError`
+        if it doesn't exist or has expired.
 
         `request`: The Django request object.
         `oauth_request`: The `oauth2.Request` object.
@@ -0,0 +1,158 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import smart_str
+
+from piston.models import Consumer, Token
+from piston.utils import LRUCache
+
+
+class ObjectCache(object):
+    """
+    Cache for objects the store looks up by key, like consumers and access
+    tokens. Entries live in a bounded in-process LRU for `ttl` seconds and,
+    if `backend` is a Django cache, are shared between processes through it.
+
+    Every lookup returns a copy, so requests never share an instance. The
+    related objects named in `uncached`, e.g. `'user'` or `'consumer.user'`,
+    are left out of the cache and loaded by each request which uses them,
+    so they're never stale, and saving them can't write stale fields back.
+
+    Entries are invalidated explicitly with `invalidate`. Other processes
+    may keep serving their local copy for up to `ttl` seconds after that;
+    a `ttl` of 0 disables caching altogether.
+    """
+    def __init__(self, prefix, maxsize=1024, ttl=300, backend=None, uncached=()):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.backend = backend
+        self.uncached = uncached
+        self.local = LRUCache(maxsize, ttl)
+
+    def cache_key(self, key):
+        """
+        Keys come straight from the client, unverified, so they're
+        hashed to stay within what memcached accepts.
+        """
+        return 'piston-oauth:%s:%s' % (self.prefix, hashlib.md5(smart_str(key)).hexdigest())
+
+    def get(self, key, load):
+        """
+        Returns the object for `key`, calling `load(key)` on a miss.
+        Exceptions raised by `load` aren't cached.
+        """
+        if not self.ttl:
+            return load(key)
+
+        obj = self.local.get(key)
+        if obj is not None:
+            return copy.deepcopy(obj)
+
+        if self.backend is not None:
+            obj = self.backend.get(self.cache_key(key))
+
+        if obj is None:
+            obj = load(key)
+            self.set(key, obj)
+        else:
+            self.local.set(key, copy.deepcopy(obj))
+
+        return obj
+
+    def set(self, key, obj):
+        if not self.ttl:
+            return
+
+        obj = self.snapshot(obj)
+        self.local.set(key, obj)
+
+        if self.backend is not None:
+            self.backend.set(self.cache_key(key), obj, self.ttl)
+
+    def snapshot(self, obj):
+        """
+        Returns a copy of `obj` to cache, without its `uncached` relations.
+        """
+        obj = copy.deepcopy(obj)
+
+        for path in self.uncached:
+            names = path.split('.')
+            related = obj
+
+            for name in names[:-1]:
+                related = getattr(related, name, None)
+
+            if related is not None:
+                field = related._meta.get_field(names[-1])
+                related.__dict__.pop(field.get_cache_name(), None)
+
+        return obj
+
+    def invalidate(self, key):
+        self.local.delete(key)
+
+        if self.backend is not None:
+            self.backend.delete(self.cache_key(key))
+
+    def clear(self):
+        self.local.clear()
+
+
+def get_backend():
+    """
+    Returns the Django cache named by `PISTON_OAUTH_CACHE_BACKEND`, if any.
+    """
+    backend = getattr(settings, 'PISTON_OAUTH_CACHE_BACKEND', None)
+
+    if backend:
+        return get_cache(backend)
+
+    return None
+
+
+def object_cache(prefix, uncached=()):
+    """
+    Creates an `ObjectCache` configured by the `PISTON_OAUTH_CACHE_*` settings.
+    """
+    return ObjectCache(prefix,
+        maxsize=getattr(settings, 'PISTON_OAUTH_CACHE_SIZE', 1024),
+        ttl=getattr(settings, 'PISTON_OAUTH_CACHE_TTL', 300),
+        backend=get_backend(), uncached=uncached)
+
+
+def invalidate_tokens(caches, **filters):
+    """
+    Invalidates the tokens matching `filters` in every cache of `caches`.
+    Cached tokens carry a copy of their consumer, which has to be dropped
+    when it changes, e.g. when it's canceled.
+    """
+    for key in Token.objects.filter(**filters).values_list('key', flat=True):
+        for objects in caches:
+            objects.invalidate(key)
+
+
+# Users are loaded per request: they change often, e.g. on every login,
+# and handlers may save `request.user`.
+CONSUMER_UNCACHED = ('user',)
+TOKEN_UNCACHED = ('user', 'consumer.user')
+
+consumers = object_cache('consumer', CONSUMER_UNCACHED)
+tokens = object_cache('token', TOKEN_UNCACHED)
+
+
+def invalidate_consumer(sender, instance, **kwargs):
+    consumers.invalidate(instance.key)
+    invalidate_tokens([ tokens ], consumer=instance)
+
+post_save.connect(invalidate_consumer, sender=Consumer, dispatch_uid='piston.oauth.invalidate_consumer')
+post_delete.connect(invalidate_consumer, sender=Consumer, dispatch_uid='piston.oauth.invalidate_consumer')
+
+
+def invalidate_token(sender, instance, **kwargs):
+    tokens.invalidate(instance.key)
+
+post_save.connect(invalidate_token, sender=Token, dispatch_uid='piston.oauth.invalidate_token')
+post_delete.connect(invalidate_token, sender=Token, dispatch_uid='piston.oauth.invalidate_token')
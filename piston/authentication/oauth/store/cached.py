@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+
+from piston.authentication.oauth.store import InvalidTokenError
+from piston.authentication.oauth.store.cache import ObjectCache, get_backend, invalidate_tokens, \
+    CONSUMER_UNCACHED, TOKEN_UNCACHED
+from piston.authentication.oauth.store.db import ModelStore
+from piston.authentication.oauth.store.nonces import CacheNonceChecker, nonce_checker, nonce_window
+from piston.models import Token, Consumer
+
+
+class CachedStore(ModelStore):
+    """
+    Store implementation serving consumers, tokens and nonces from a Django
+    cache, so that authenticating a request with a known consumer and access
+    token doesn't query the database at all.
+
+    The models stay the source of truth: tokens are written to the database
+    as they're created and authorized, and put in the cache right after.
+    Lookups which miss the cache fall back to `ModelStore`.
+
+    `backend` defaults to the cache named by `PISTON_OAUTH_CACHE_BACKEND`.
+    Nonces are then only kept in that cache, see `CacheNonceChecker`.
+    Without either, objects are kept in the default cache, but nonces are
+    checked like `ModelStore` does, since the default cache may well be
+    a dummy or per-process one, which wouldn't stop replays. To use it,
+    set `PISTON_OAUTH_STORE` to
+    `'piston.authentication.oauth.store.cached.CachedStore'`.
+    """
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = get_backend()
+
+        if backend is None:
+            backend = cache
+            self.nonce_checker = nonce_checker
+        else:
+            self.nonce_checker = CacheNonceChecker(nonce_window(), backend)
+
+        maxsize = getattr(settings, 'PISTON_OAUTH_CACHE_SIZE', 1024)
+        ttl = getattr(settings, 'PISTON_OAUTH_CACHE_TTL', 300)
+
+        self.consumers = ObjectCache('consumer', maxsize, ttl, backend, CONSUMER_UNCACHED)
+        self.tokens = ObjectCache('token', maxsize, ttl, backend, TOKEN_UNCACHED)
+        self.request_tokens = ObjectCache('request-token', maxsize, ttl, backend, TOKEN_UNCACHED)
+
+        uid = 'piston.oauth.cachedstore.%d.%%s' % id(self)
+
+        for signal in (post_save, post_delete):
+            signal.connect(self.invalidate_consumer, sender=Consumer, dispatch_uid=uid % 'consumer')
+            signal.connect(self.invalidate_token, sender=Token, dispatch_uid=uid % 'token')
+
+    def invalidate_consumer(self, sender, instance, **kwargs):
+        self.consumers.invalidate(instance.key)
+        invalidate_tokens([ self.tokens, self.request_tokens ], consumer=instance)
+
+    def invalidate_token(self, sender, instance, **kwargs):
+        if instance.token_type == Token.REQUEST:
+            self.request_tokens.invalidate(instance.key)
+        else:
+            self.tokens.invalidate(instance.key)
+
+    def create_request_token(self, request, oauth_request, consumer, callback):
+        token = super(CachedStore, self).create_request_token(
+            request, oauth_request, consumer, callback)
+        self.request_tokens.set(token.key, token)
+        return token
+
+    def get_request_token(self, request, oauth_request, request_token_key):
+        try:
+            token = self.request_tokens.get(request_token_key, self.load_request_token)
+        except Token.DoesNotExist:
+            raise InvalidTokenError()
+
+        if token.is_expired():
+            raise InvalidTokenError()
+
+        return token
+
+    def load_request_token(self, request_token_key):
+        return Token.objects.select_related('consumer', 'user').get(
+            key=request_token_key, token_type=Token.REQUEST)
+
+    def authorize_request_token(self, request, oauth_request, request_token):
+        request_token = super(CachedStore, self).authorize_request_token(
+            request, oauth_request, request_token)
+        self.request_tokens.set(request_token.key, request_token)
+        return request_token
+
+    def create_access_token(self, request, oauth_request, consumer, request_token):
+        access_token = super(CachedStore, self).create_access_token(
+            request, oauth_request, consumer, request_token)
+        self.tokens.set(access_token.key, access_token)
+        return access_token
@@ -1,19 +1,34 @@
+import time
+
 import oauth2 as oauth
 
 from piston.authentication.oauth.store import InvalidConsumerError, InvalidTokenError, Store
-from piston.models import Nonce, Token, Consumer, VERIFIER_SIZE
+from piston.authentication.oauth.store.cache import consumers, tokens
+from piston.authentication.oauth.store.nonces import nonce_checker
+from piston.models import Token, Consumer, VERIFIER_SIZE, save_with_random_codes
 
 
 class ModelStore(Store):
     """
     Store implementation using the Django models defined in `piston.models`.
+
+    Consumers and access tokens are cached, see
+    `piston.authentication.oauth.store.cache`. Expired tokens are refused,
+    see `TokenManager.ttl`, and can be removed with `./manage.py purge_tokens`.
     """
+    consumers = consumers
+    tokens = tokens
+    nonce_checker = nonce_checker
+
     def get_consumer(self, request, oauth_request, consumer_key):
         try:
-            return Consumer.objects.get(key=consumer_key)
+            return self.consumers.get(consumer_key, self.load_consumer)
         except Consumer.DoesNotExist:
             raise InvalidConsumerError()
 
+    def load_consumer(self, consumer_key):
+        return Consumer.objects.select_related('user').get(key=consumer_key)
+
     def get_consumer_for_request_token(self, request, oauth_request, request_token):
         return request_token.consumer
 
@@ -21,22 +36,29 @@ class ModelStore(Store):
         return access_token.consumer
 
     def create_request_token(self, request, oauth_request, consumer, callback):
-        token = Token.objects.create_token(
+        token = Token(
             token_type=Token.REQUEST,
-            consumer=Consumer.objects.get(key=oauth_request['oauth_consumer_key']),
+            consumer=consumer,
             timestamp=oauth_request['oauth_timestamp']
         )
-        token.set_callback(callback)
-        token.save()
 
-        return token
+        if callback != 'oob':
+            token.callback = callback
+            token.callback_confirmed = True
+
+        return save_with_random_codes(token)
 
     def get_request_token(self, request, oauth_request, request_token_key):
         try:
-            return Token.objects.get(key=request_token_key, token_type=Token.REQUEST)
+            token = Token.objects.get(key=request_token_key, token_type=Token.REQUEST)
         except Token.DoesNotExist:
             raise InvalidTokenError()
 
+        if token.is_expired():
+            raise InvalidTokenError()
+
+        return token
+
     def authorize_request_token(self, request, oauth_request, request_token):
         request_token.is_approved = True
         request_token.user = request.user
@@ -48,7 +70,7 @@ class ModelStore(Store):
         access_token = Token.objects.create_token(
             token_type=Token.ACCESS,
             timestamp=oauth_request['oauth_timestamp'],
-            consumer=Consumer.objects.get(key=consumer.key),
+            consumer=consumer,
             user=request_token.user,
         )
         request_token.delete()
@@ -56,10 +78,24 @@ class ModelStore(Store):
 
     def get_access_token(self, request, oauth_request, consumer, access_token_key):
         try:
-            return Token.objects.get(key=access_token_key, token_type=Token.ACCESS)
+            token = self.tokens.get(access_token_key, self.load_access_token)
         except Token.DoesNotExist:
             raise InvalidTokenError()
 
+        if token.is_expired():
+            raise InvalidTokenError()
+
+        return token
+
+    def load_access_token(self, access_token_key):
+        """
+        Loads an access token along with its user and consumer, which
+        authentication needs right after, in a single query. Only the
+        token and consumer are cached; later requests load the user.
+        """
+        return Token.objects.select_related('user', 'consumer').get(
+            key=access_token_key, token_type=Token.ACCESS)
+
     def get_user_for_access_token(self, request, oauth_request, access_token):
         return access_token.user
 
@@ -67,9 +103,17 @@ class ModelStore(Store):
         return consumer.user
 
     def check_nonce(self, request, oauth_request, nonce):
-        nonce, created = Nonce.objects.get_or_create(
-            consumer_key=oauth_request['oauth_consumer_key'],
-            token_key=oauth_request.get('oauth_token', ''),
-            key=nonce
-        )
-        return created
+        """
+        Nonces are only remembered for `PISTON_OAUTH_NONCE_WINDOW` seconds,
+        so requests with a timestamp outside that window are refused.
+        """
+        try:
+            timestamp = int(oauth_request['oauth_timestamp'])
+        except (KeyError, ValueError):
+            return False
+
+        if abs(time.time() - timestamp) > self.nonce_checker.window:
+            return False
+
+        return self.nonce_checker.check(oauth_request['oauth_consumer_key'],
+            oauth_request.get('oauth_token', ''), nonce, timestamp)
@@ -0,0 +1,132 @@
+import time
+
+import oauth2 as oauth
+
+from piston.authentication.oauth.store import InvalidConsumerError, InvalidTokenError, Store
+from piston.authentication.oauth.store.nonces import nonce_window
+from piston.models import Token, Consumer, generate_random, KEY_SIZE, SECRET_SIZE, VERIFIER_SIZE
+
+
+class MemoryStore(Store):
+    """
+    Store implementation keeping consumers, tokens and nonces in dicts, for
+    test suites which shouldn't pay for database round trips on every OAuth
+    request. Nothing is shared between processes or survives a restart.
+
+    Consumers and tokens are unsaved `piston.models` instances, so they work
+    wherever the models do. Add consumers with `add_consumer`, and tokens to
+    skip the request token dance with `add_token`. To use it, set
+    `PISTON_OAUTH_STORE` to
+    `'piston.authentication.oauth.store.memory.MemoryStore'` in your test
+    settings; `piston.test.TestCase` clears it before each test.
+    """
+    def __init__(self):
+        self.window = nonce_window()
+        self.clear()
+
+    def clear(self):
+        self.consumers = { }
+        self.request_tokens = { }
+        self.access_tokens = { }
+        self.nonces = set()
+
+    def add_consumer(self, name='', user=None, key=None, secret=None, status='accepted'):
+        consumer = Consumer(name=name, user=user, status=status,
+                            key=key or generate_random(KEY_SIZE),
+                            secret=secret or generate_random(SECRET_SIZE))
+        self.consumers[consumer.key] = consumer
+        return consumer
+
+    def add_token(self, consumer, user=None, token_type=Token.ACCESS, key=None, secret=None, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        token = Token(consumer=consumer, user=user, token_type=token_type, timestamp=timestamp,
+                      key=key or generate_random(KEY_SIZE),
+                      secret=secret or generate_random(SECRET_SIZE))
+
+        if token_type == Token.REQUEST:
+            self.request_tokens[token.key] = token
+        else:
+            self.access_tokens[token.key] = token
+
+        return token
+
+    def get_consumer(self, request, oauth_request, consumer_key):
+        try:
+            return self.consumers[consumer_key]
+        except KeyError:
+            raise InvalidConsumerError()
+
+    def get_consumer_for_request_token(self, request, oauth_request, request_token):
+        return request_token.consumer
+
+    def get_consumer_for_access_token(self, request, oauth_request, access_token):
+        return access_token.consumer
+
+    def create_request_token(self, request, oauth_request, consumer, callback):
+        token = self.add_token(consumer, token_type=Token.REQUEST,
+                               timestamp=int(oauth_request['oauth_timestamp']))
+
+        if callback != 'oob':
+            token.callback = callback
+            token.callback_confirmed = True
+
+        return token
+
+    def get_request_token(self, request, oauth_request, request_token_key):
+        try:
+            token = self.request_tokens[request_token_key]
+        except KeyError:
+            raise InvalidTokenError()
+
+        if token.is_expired():
+            raise InvalidTokenError()
+
+        return token
+
+    def authorize_request_token(self, request, oauth_request, request_token):
+        request_token.is_approved = True
+        request_token.user = request.user
+        request_token.verifier = oauth.generate_verifier(VERIFIER_SIZE)
+        return request_token
+
+    def create_access_token(self, request, oauth_request, consumer, request_token):
+        access_token = self.add_token(consumer, user=request_token.user,
+                                      timestamp=int(oauth_request['oauth_timestamp']))
+        self.request_tokens.pop(request_token.key, None)
+        return access_token
+
+    def get_access_token(self, request, oauth_request, consumer, access_token_key):
+        try:
+            token = self.access_tokens[access_token_key]
+        except KeyError:
+            raise InvalidTokenError()
+
+        if token.is_expired():
+            raise InvalidTokenError()
+
+        return token
+
+    def get_user_for_access_token(self, request, oauth_request, access_token):
+        return access_token.user
+
+    def get_user_for_consumer(self, request, oauth_request, consumer):
+        return consumer.user
+
+    def check_nonce(self, request, oauth_request, nonce):
+        try:
+            timestamp = int(oauth_request['oauth_timestamp'])
+        except (KeyError, ValueError):
+            return False
+
+        if abs(time.time() - timestamp) > self.window:
+            return False
+
+        key = (oauth_request['oauth_consumer_key'], oauth_request.get('oauth_token', ''), nonce)
+
+        if key in self.nonces:
+            return False
+
+        self.nonces.add(key)
+        return True
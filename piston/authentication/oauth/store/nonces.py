@@ -0,0 +1,92 @@
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.encoding import smart_str
+
+from piston.models import Nonce
+
+
+def nonce_window():
+    """
+    Returns how many seconds a request's `oauth_timestamp` may be off from
+    the current time, which is also how long its nonce has to be remembered.
+    """
+    return getattr(settings, 'PISTON_OAUTH_NONCE_WINDOW', 300)
+
+
+class ModelNonceChecker(object):
+    """
+    Remembers nonces in the `Nonce` table. Nonces older than the window
+    are no longer needed, and can be removed with `./manage.py purge_nonces`.
+    """
+    def __init__(self, window):
+        self.window = window
+
+    def check(self, consumer_key, token_key, nonce, timestamp):
+        nonce, created = Nonce.objects.get_or_create(
+            consumer_key=consumer_key,
+            token_key=token_key,
+            key=nonce,
+            defaults={'timestamp': timestamp}
+        )
+        return created
+
+    def purge(self, now=None, batch_size=1000):
+        """
+        Deletes the nonces which fell out of the window, in batches of
+        `batch_size`. Returns the number of nonces deleted.
+        """
+        if now is None:
+            now = time.time()
+
+        expired = Nonce.objects.filter(timestamp__lt=int(now) - self.window)
+        deleted = 0
+
+        while True:
+            pks = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+
+            Nonce.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+
+
+class CacheNonceChecker(object):
+    """
+    Remembers nonces in a Django cache, using its atomic `add` with a
+    timeout lasting until the request's timestamp leaves the window.
+    Replay protection costs a single cache operation, and nothing has
+    to be purged. Use a cache which doesn't evict early, like memcached
+    with enough memory, as an evicted nonce can be replayed.
+    """
+    def __init__(self, window, cache):
+        self.window = window
+        self.cache = cache
+
+    def check(self, consumer_key, token_key, nonce, timestamp):
+        key = 'piston-nonce:%s' % hashlib.md5(smart_str(
+            u'%s:%s:%s' % (consumer_key, token_key, nonce))).hexdigest()
+        timeout = int(timestamp + self.window - time.time()) + 1
+
+        return self.cache.add(key, timestamp, max(timeout, 1))
+
+    def purge(self, now=None, batch_size=1000):
+        return 0
+
+
+def get_nonce_checker():
+    """
+    Returns a `CacheNonceChecker` if `PISTON_OAUTH_NONCE_CACHE` names a
+    cache backend, or a `ModelNonceChecker` otherwise.
+    """
+    backend = getattr(settings, 'PISTON_OAUTH_NONCE_CACHE', None)
+
+    if backend:
+        return CacheNonceChecker(nonce_window(), get_cache(backend))
+
+    return ModelNonceChecker(nonce_window())
+
+
+nonce_checker = get_nonce_checker()
@@ -1,37 +1,182 @@
+import time
+import hmac
+import urllib
+import hashlib
+import binascii
+
 import oauth2 as oauth
 from django.contrib.auth.models import User
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, QueryDict
+from django.utils.encoding import iri_to_uri
+
+from piston.authentication.oauth.store.nonces import nonce_window
+from piston.utils import LRUCache
+
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+def request_url(request, path):
+    """ Builds the absolute URL for `path` on the host `request` was sent to. """
+    if request.is_secure():
+        scheme = 'https'
+    else:
+        scheme = 'http'
+
+    return iri_to_uri('%s://%s%s' % (scheme, request.get_host(), path))
+
+
+def split_header(header):
+    """
+    Parses the parameters of an `Authorization` header, given
+    without its `OAuth ` prefix, leaving out the `realm`. Raises
+    `ValueError` if the header is malformed.
+    """
+    parameters = {}
+
+    for param in header.split(','):
+        param = param.strip()
+        if not param:
+            continue
+
+        name, value = param.split('=', 1)
+        name = urllib.unquote(name.strip())
+
+        if name != 'realm':
+            parameters[name] = urllib.unquote(value.strip().strip('"'))
+
+    return parameters
+
+
+def form_parameters(request):
+    """
+    Returns the parameters of a form-encoded body, whatever the method.
+    `coerce_put_post` has already set them up for PUT and PATCH requests
+    coming through a `Resource`, otherwise the body is parsed here.
+    """
+    if request.method == 'POST':
+        return request.POST
+
+    if request.method in ('PUT', 'PATCH'):
+        data = getattr(request, request.method, None)
+        if data is not None:
+            return data
+
+    return QueryDict(request.raw_post_data)
 
 
 def get_oauth_request(request):
-    """ Converts a Django request object into an `oauth2.Request` object. """
-    headers = {}
-    if 'HTTP_AUTHORIZATION' in request.META:
-        headers['Authorization'] = request.META['HTTP_AUTHORIZATION']
-    return oauth.Request.from_request(request.method, request.build_absolute_uri(request.path), headers, dict(request.REQUEST))
+    """
+    Converts a Django request object into an `oauth2.Request` object, which
+    is kept on the request as `oauth_request`, so later calls reuse it.
+
+    If the OAuth parameters are in the `Authorization` header, the query
+    string stays in the URL, where the signature base picks it up, and
+    only a form-encoded body is read, as it is part of the signature too,
+    for any method.
+    Otherwise the parameters are gathered from GET and POST.
+    """
+    oauth_request = getattr(request, 'oauth_request', None)
+    if oauth_request is not None:
+        return oauth_request
+
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+
+    if auth_header[:6] == 'OAuth ':
+        try:
+            parameters = split_header(auth_header[6:])
+        except ValueError:
+            return None
+
+        if request.META.get('CONTENT_TYPE', '').startswith(FORM_CONTENT_TYPE):
+            parameters.update(form_parameters(request).items())
+
+        oauth_request = oauth.Request(request.method, request_url(request, request.get_full_path()), parameters)
+    else:
+        oauth_request = oauth.Request.from_request(request.method, request_url(request, request.path), {}, dict(request.REQUEST))
+
+    request.oauth_request = oauth_request
+    return oauth_request
+
+
+class SignatureMethod_HMAC_SHA256(oauth.SignatureMethod_HMAC_SHA1):
+    name = 'HMAC-SHA256'
+
+    def sign(self, request, consumer, token):
+        key, raw = self.signing_base(request, consumer, token)
+        hashed = hmac.new(key, raw, hashlib.sha256)
+        return binascii.b2a_base64(hashed.digest())[:-1]
+
+
+class Verifier(object):
+    """
+    Verifies signed requests. Built once and shared, along with the
+    ascii-encoded copies of consumer and token credentials which the
+    signature methods need, so these aren't rebuilt for every request.
+    Credentials are cached by key and secret, so a changed secret is
+    picked up right away.
+    """
+    def __init__(self, window=300, maxsize=1024):
+        self.window = window
+        self.server = oauth.Server()
+        self.server.timestamp_threshold = window
+        self.server.add_signature_method(oauth.SignatureMethod_HMAC_SHA1())
+        self.server.add_signature_method(SignatureMethod_HMAC_SHA256())
+        self.server.add_signature_method(oauth.SignatureMethod_PLAINTEXT())
+        self.credentials = LRUCache(maxsize)
+
+    def credential(self, cls, obj):
+        cache_key = (cls, obj.key, obj.secret)
+        credential = self.credentials.get(cache_key)
+
+        if credential is None:
+            # Ensure the passed keys and secrets are ascii, or HMAC will complain.
+            credential = cls(obj.key.encode('ascii', 'ignore'), obj.secret.encode('ascii', 'ignore'))
+            self.credentials.set(cache_key, credential)
+
+        return credential
+
+    def verify(self, oauth_request, consumer, token=None):
+        consumer = self.credential(oauth.Consumer, consumer)
+        if token is not None:
+            token = self.credential(oauth.Token, token)
+
+        try:
+            self.server.verify_request(oauth_request, consumer, token)
+        except oauth.Error:
+            return False
+
+        return True
+
+
+verifier = Verifier(nonce_window())
 
 
 def verify_oauth_request(request, oauth_request, consumer, token=None):
-    """ Helper function to verify requests. """
+    """
+    Helper function to verify requests.
+
+    Checks are ordered from cheap to expensive, so that forged or stale
+    requests are refused without touching storage: the timestamp first,
+    then the signature, and only then is the nonce recorded.
+    """
     from piston.authentication.oauth.store import store
 
-    # Check nonce
-    if not store.check_nonce(request, oauth_request, oauth_request['oauth_nonce']):
+    # Check timestamp
+    try:
+        timestamp = int(oauth_request['oauth_timestamp'])
+    except (KeyError, ValueError):
         return False
 
-    # Verify request
-    try:
-        oauth_server = oauth.Server()
-        oauth_server.add_signature_method(oauth.SignatureMethod_HMAC_SHA1())
-        oauth_server.add_signature_method(oauth.SignatureMethod_PLAINTEXT())
+    if abs(time.time() - timestamp) > verifier.window:
+        return False
 
-        # Ensure the passed keys and secrets are ascii, or HMAC will complain.
-        consumer = oauth.Consumer(consumer.key.encode('ascii', 'ignore'), consumer.secret.encode('ascii', 'ignore'))
-        if token is not None:
-            token = oauth.Token(token.key.encode('ascii', 'ignore'), token.secret.encode('ascii', 'ignore'))
+    # Verify request
+    if not verifier.verify(oauth_request, consumer, token):
+        return False
 
-        oauth_server.verify_request(oauth_request, consumer, token)
-    except oauth.Error:
+    # Check nonce
+    if not store.check_nonce(request, oauth_request, oauth_request['oauth_nonce']):
         return False
 
     return True
@@ -0,0 +1,179 @@
+import sys
+import logging
+import threading
+
+from django.core.urlresolvers import resolve, Resolver404, get_urlconf, set_urlconf
+from django.db import connections
+from django.http import HttpRequest, QueryDict, Http404
+from django.utils import simplejson, translation
+from django.views.debug import ExceptionReporter
+
+from handler import BaseHandler
+from resource import Resource
+from authentication import NoAuthentication
+from utils import rc
+
+logger = logging.getLogger('piston.batch')
+
+class BatchHandler(BaseHandler):
+    """
+    Handler multiplexing several API calls into one. POST a
+    list of sub-requests (or a dict with `requests` and
+    `parallel` keys) like::
+
+        [ { "method": "GET", "path": "/api/posts/?page=2" },
+          { "method": "POST", "path": "/api/posts/",
+            "body": { "title": "Hello" } } ]
+
+    Every sub-request is resolved through the URL conf and
+    dispatched in-process to its `Resource`, as the user who
+    authenticated the batch itself. The response holds one
+    `{ "status": ..., "body": ... }` entry per sub-request, in
+    order, emitted in the format negotiated for the batch.
+
+    Map it like any other handler::
+
+        batch = Resource(BatchHandler, authentication=auth)
+    """
+    allowed_methods = ('POST',)
+
+    max_requests = 20
+    parallel = False
+    max_workers = 4
+
+    COPIED_ATTRIBUTES = ('user', 'consumer', 'throttle_extra', 'session')
+
+    def create(self, request, *args, **kwargs):
+        items, parallel = request.data, False
+
+        if isinstance(items, dict):
+            parallel = self.parallel and bool(items.get('parallel'))
+            items = items.get('requests')
+
+        if not isinstance(items, (list, tuple)) or len(items) > self.max_requests:
+            return rc.BAD_REQUEST
+
+        if parallel and len(items) > 1:
+            return self.dispatch_parallel(request, items)
+
+        return [ self.dispatch(request, item) for item in items ]
+
+    def dispatch_parallel(self, request, items):
+        """
+        Runs sub-requests on up to `max_workers` threads. Only
+        enabled if the handler sets `parallel`, since handlers
+        now have to be thread-safe and use separate connections.
+        """
+        results = [ None ] * len(items)
+        pending = list(enumerate(items))
+
+        # Both are thread-local, so workers have to take them over
+        # from the thread which is handling the batch.
+        urlconf, language = get_urlconf(), translation.get_language()
+
+        def worker():
+            set_urlconf(urlconf)
+            if language:
+                translation.activate(language)
+            try:
+                while True:
+                    try:
+                        idx, item = pending.pop()
+                    except IndexError:
+                        return
+                    results[idx] = self.dispatch(request, item)
+            finally:
+                translation.deactivate()
+                set_urlconf(None)
+
+                for conn in connections.all():
+                    conn.close()
+
+        threads = [ threading.Thread(target=worker)
+                    for _ in range(min(self.max_workers, len(items))) ]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def dispatch(self, request, item):
+        try:
+            method = str(item.get('method', 'GET')).upper()
+            path, _, query = item['path'].partition('?')
+        except (AttributeError, KeyError, TypeError):
+            return { 'status': 400 }
+
+        try:
+            view, args, kwargs = resolve(path)
+        except Resolver404:
+            return { 'status': 404 }
+
+        if not isinstance(view, Resource):
+            return { 'status': 404 }
+
+        if isinstance(view.handler, BatchHandler):
+            return { 'status': 400 }
+
+        sub = self.sub_request(request, method, path, query, item.get('body'))
+        kwargs = dict(kwargs, emitter_format='json')
+
+        try:
+            resp = view(sub, *args, **kwargs)
+        except Http404:
+            return { 'status': 404 }
+        except Exception:
+            exc_type, exc_value, tb = sys.exc_info()
+            logger.error("Batched %s %s failed", method, path, exc_info=True)
+            view.report_crash(ExceptionReporter(sub, exc_type, exc_value, tb), exc_type, tb)
+            return { 'status': 500 }
+
+        body = resp.content
+
+        if resp.get('Content-Type', '').startswith('application/json'):
+            try:
+                body = simplejson.loads(body)
+            except ValueError:
+                pass
+
+        return { 'status': resp.status_code, 'body': body }
+
+    def sub_request(self, request, method, path, query, body):
+        """
+        Builds the request passed on to a `Resource`. It shares
+        the batch's user and authentication, and carries an
+        already decoded `data` so the body isn't parsed again.
+        """
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = path
+        sub.COOKIES = request.COOKIES
+
+        sub.META = request.META.copy()
+        sub.META.pop('CONTENT_LENGTH', None)
+        sub.META.update({ 'REQUEST_METHOD': method,
+                          'PATH_INFO': path,
+                          'QUERY_STRING': query,
+                          'CONTENT_TYPE': 'application/json' })
+
+        sub.GET = QueryDict(query)
+        sub.POST = QueryDict('')
+        sub._raw_post_data = ''
+
+        if body is None:
+            sub.data, sub.content_type = { }, None
+        else:
+            sub.data, sub.content_type = body, 'application/json'
+
+        for attr in self.COPIED_ATTRIBUTES:
+            if hasattr(request, attr):
+                setattr(sub, attr, getattr(request, attr))
+
+        authenticator = getattr(request, 'authenticator', None)
+
+        if authenticator is not None and not isinstance(authenticator, NoAuthentication):
+            sub.authenticator = authenticator
+
+        return sub
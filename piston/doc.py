@@ -74,6 +74,8 @@ class HandlerMethod(object):
             return 'DELETE'
         elif self.name == 'update':
             return 'PUT'
+        elif self.name == 'partial_update':
+            return 'PATCH'
     
     def __repr__(self):
         return "<Method: %s>" % self.name
@@ -83,7 +85,7 @@ class HandlerDocumentation(object):
         self.handler = handler
         
     def get_methods(self, include_default=False):
-        for method in "read create update delete".split():
+        for method in "read create update partial_update delete".split():
             met = getattr(self.handler, method, None)
 
             if not met:
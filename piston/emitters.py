@@ -30,7 +30,7 @@ from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.http import HttpResponse
 from django.core import serializers
 
-from utils import HttpStatusCode, Mimer
+from utils import HttpStatusCode, Mimer, LRUCache, parse_accept_header, load_json_stream
 from validate_jsonp import is_valid_jsonp_callback_value
 
 try:
@@ -59,8 +59,12 @@ class Emitter(object):
     as the methods on the handler. Issue58 says that's no good.
     """
     EMITTERS = { }
+    MIMES = { }
+    NEGOTIATED = LRUCache(64)
     RESERVED_FIELDS = set([ 'read', 'update', 'create',
-                            'delete', 'model', 'anonymous',
+                            'delete', 'partial_update',
+                            'bulk_create', 'bulk_update', 'bulk_delete',
+                            'model', 'anonymous',
                             'allowed_methods', 'fields', 'exclude' ])
 
     def __init__(self, payload, typemapper, handler, fields=(), anonymous=True):
@@ -69,6 +73,7 @@ class Emitter(object):
         self.handler = handler
         self.fields = fields
         self.anonymous = anonymous
+        self.tracker = None
 
         if isinstance(self.data, Exception):
             raise
@@ -145,6 +150,58 @@ class Emitter(object):
             """
             return [ _model(m, fields) for m in getattr(data, field.name).iterator() ]
 
+        def _traced(name, func, *args):
+            """
+            Runs `func`, attributing the queries it causes to
+            the field `name` if a query tracker is attached.
+            """
+            if self.tracker is None:
+                return func(*args)
+
+            self.tracker.push(name)
+            try:
+                return func(*args)
+            finally:
+                self.tracker.pop()
+
+        def _remainder(ret, data, handler, met_fields, maybe_field):
+            """
+            Fields which aren't plain model fields: nested
+            specs, resource methods and other attributes.
+            """
+            if isinstance(maybe_field, (list, tuple)):
+                model, fields = maybe_field
+                inst = getattr(data, model, None)
+
+                if inst:
+                    if hasattr(inst, 'all'):
+                        ret[model] = _related(inst, fields)
+                    elif callable(inst):
+                        if len(inspect.getargspec(inst)[0]) == 1:
+                            ret[model] = _any(inst(), fields)
+                    else:
+                        ret[model] = _model(inst, fields)
+
+            elif maybe_field in met_fields:
+                # Overriding normal field which has a "resource method"
+                # so you can alter the contents of certain fields without
+                # using different names.
+                ret[maybe_field] = _any(met_fields[maybe_field](data))
+
+            else:
+                maybe = getattr(data, maybe_field, None)
+                if maybe is not None:
+                    if callable(maybe):
+                        if len(inspect.getargspec(maybe)[0]) <= 1:
+                            ret[maybe_field] = _any(maybe())
+                    else:
+                        ret[maybe_field] = _any(maybe)
+                else:
+                    handler_f = getattr(handler or self.handler, maybe_field, None)
+
+                    if handler_f:
+                        ret[maybe_field] = _any(handler_f(data))
+
         def _model(data, fields=None):
             """
             Models. Will respect the `fields` and/or
@@ -202,49 +259,23 @@ class Emitter(object):
                                 get_fields.remove(f.attname)
                         else:
                             if f.attname[:-3] in get_fields:
-                                ret[f.name] = _fk(data, f)
+                                ret[f.name] = _traced(f.name, _fk, data, f)
                                 get_fields.remove(f.name)
 
                 for mf in data._meta.many_to_many:
                     if mf.serialize and mf.attname not in met_fields:
                         if mf.attname in get_fields:
-                            ret[mf.name] = _m2m(data, mf)
+                            ret[mf.name] = _traced(mf.name, _m2m, data, mf)
                             get_fields.remove(mf.name)
 
                 # try to get the remainder of fields
                 for maybe_field in get_fields:
                     if isinstance(maybe_field, (list, tuple)):
-                        model, fields = maybe_field
-                        inst = getattr(data, model, None)
-
-                        if inst:
-                            if hasattr(inst, 'all'):
-                                ret[model] = _related(inst, fields)
-                            elif callable(inst):
-                                if len(inspect.getargspec(inst)[0]) == 1:
-                                    ret[model] = _any(inst(), fields)
-                            else:
-                                ret[model] = _model(inst, fields)
-
-                    elif maybe_field in met_fields:
-                        # Overriding normal field which has a "resource method"
-                        # so you can alter the contents of certain fields without
-                        # using different names.
-                        ret[maybe_field] = _any(met_fields[maybe_field](data))
-
+                        name = maybe_field[0]
                     else:
-                        maybe = getattr(data, maybe_field, None)
-                        if maybe is not None:
-                            if callable(maybe):
-                                if len(inspect.getargspec(maybe)[0]) <= 1:
-                                    ret[maybe_field] = _any(maybe())
-                            else:
-                                ret[maybe_field] = _any(maybe)
-                        else:
-                            handler_f = getattr(handler or self.handler, maybe_field, None)
+                        name = maybe_field
 
-                            if handler_f:
-                                ret[maybe_field] = _any(handler_f(data))
+                    _traced(name, _remainder, ret, data, handler, met_fields, maybe_field)
 
             else:
                 for f in data._meta.fields:
@@ -330,6 +361,42 @@ class Emitter(object):
 
         raise ValueError("No emitters found for type %s" % format)
 
+    @classmethod
+    def negotiate(cls, accept, default='json'):
+        """
+        Picks the name of the registered emitter best matching
+        the `Accept` header in `accept`, honouring q-values.
+        Returns `default` when nothing acceptable is registered.
+
+        Results are memoized per distinct header in the bounded
+        `NEGOTIATED` cache, which is flushed whenever an emitter
+        is registered or removed.
+        """
+        if not accept:
+            return default
+
+        name = cls.NEGOTIATED.get(accept)
+
+        if name is None:
+            name = default
+
+            for mime in parse_accept_header(accept):
+                if mime == '*/*':
+                    break
+                elif mime.endswith('/*'):
+                    matches = [ n for m, n in cls.MIMES.iteritems()
+                                if m.startswith(mime[:-1]) ]
+                    if matches:
+                        name = min(matches)
+                        break
+                elif mime in cls.MIMES:
+                    name = cls.MIMES[mime]
+                    break
+
+            cls.NEGOTIATED.set(accept, name)
+
+        return name
+
     @classmethod
     def register(cls, name, klass, content_type='text/plain'):
         """
@@ -341,6 +408,8 @@ class Emitter(object):
          - `content_type`: The content type to serve response as.
         """
         cls.EMITTERS[name] = (klass, content_type)
+        cls.MIMES.setdefault(content_type.split(';')[0].strip().lower(), name)
+        cls.NEGOTIATED.clear()
 
     @classmethod
     def unregister(cls, name):
@@ -348,7 +417,18 @@ class Emitter(object):
         Remove an emitter from the registry. Useful if you don't
         want to provide output in one of the built-in emitters.
         """
-        return cls.EMITTERS.pop(name, None)
+        emitter = cls.EMITTERS.pop(name, None)
+
+        for mime, n in cls.MIMES.items():
+            if n == name:
+                del cls.MIMES[mime]
+
+        for n, (klass, content_type) in cls.EMITTERS.iteritems():
+            cls.MIMES.setdefault(content_type.split(';')[0].strip().lower(), n)
+
+        cls.NEGOTIATED.clear()
+
+        return emitter
 
 class XMLEmitter(Emitter):
     def _to_xml(self, xml, data):
@@ -397,7 +477,7 @@ class JSONEmitter(Emitter):
         return seria
 
 Emitter.register('json', JSONEmitter, 'application/json; charset=utf-8')
-Mimer.register(simplejson.loads, ('application/json',))
+Mimer.register(load_json_stream, ('application/json',), stream=True)
 
 class YAMLEmitter(Emitter):
     """
@@ -1,12 +1,39 @@
+from __future__ import with_statement
+
+import inspect
 import warnings
 
 from utils import rc
-from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, ValidationError
 from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Model
+from django.db.models.signals import pre_save, post_save
+from django.dispatch.dispatcher import _make_id
+
+# Fallback since `atomic` isn't in Django <1.6.
+try:
+    atomic = transaction.atomic
+except AttributeError:
+    atomic = transaction.commit_on_success
+
+# `save(update_fields=...)` is only in Django >=1.5.
+SAVE_UPDATE_FIELDS = 'update_fields' in inspect.getargspec(Model.save)[0]
+
+def has_listeners(signal, sender):
+    # Fallback since `has_listeners` isn't in Django <1.4.
+    if hasattr(signal, 'has_listeners'):
+        return signal.has_listeners(sender)
+
+    return bool(signal._live_receivers(_make_id(sender)))
 
 typemapper = { }
 handler_tracker = [ ]
 
+def batched(items, size):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
 class HandlerMetaClass(type):
     """
     Metaclass that keeps a registry of class -> handler
@@ -51,6 +78,13 @@ class BaseHandler(object):
     anonymous = is_anonymous = False
     exclude = ( 'id', )
     fields =  ( )
+    bulk_batch_size = 500
+
+    # Cache policy for successful GET responses, see `Resource.cache_control`.
+    cache_max_age = None
+    cache_s_maxage = None
+    cache_stale_while_revalidate = None
+    cache_public = False
 
     def flatten_dict(self, dct):
         return dict([ (str(k), dct.get(k)) for k in dct.keys() ])
@@ -97,18 +131,22 @@ class BaseHandler(object):
         if not self.has_model():
             return rc.NOT_IMPLEMENTED
 
+        if isinstance(request.data, (list, tuple)):
+            return self.bulk_create(request, *args, **kwargs)
+
         attrs = self.flatten_dict(request.data)
+        inst = self.model(**attrs)
 
+        # Duplicates are caught by the database's unique
+        # constraints rather than by querying beforehand.
         try:
-            inst = self.queryset(request).get(**attrs)
-            return rc.DUPLICATE_ENTRY
-        except self.model.DoesNotExist:
-            inst = self.model(**attrs)
-            inst.save()
-            return inst
-        except self.model.MultipleObjectsReturned:
+            with atomic():
+                inst.save()
+        except IntegrityError:
             return rc.DUPLICATE_ENTRY
 
+        return inst
+
     def update(self, request, *args, **kwargs):
         if not self.has_model():
             return rc.NOT_IMPLEMENTED
@@ -116,27 +154,122 @@ class BaseHandler(object):
         pkfield = self.model._meta.pk.name
 
         if pkfield not in kwargs:
+            if isinstance(request.data, (list, tuple)):
+                return self.bulk_update(request, *args, **kwargs)
+
             # No pk was specified
             return rc.BAD_REQUEST
 
-        try:
-            inst = self.queryset(request).get(pk=kwargs.get(pkfield))
-        except ObjectDoesNotExist:
+        attrs = self.flatten_dict(request.data)
+
+        if self.saves_instances():
+            # `save` or its signals have to run, so fetch the instance.
+            try:
+                inst = self.queryset(request).get(pk=kwargs.get(pkfield))
+            except ObjectDoesNotExist:
+                return rc.NOT_FOUND
+            except MultipleObjectsReturned: # should never happen, since we're using a PK
+                return rc.BAD_REQUEST
+
+            for k,v in attrs.iteritems():
+                setattr( inst, k, v )
+
+            self.save_instance(inst, attrs)
+            return rc.ALL_OK
+
+        # Otherwise it's a single UPDATE, skipping the fetch; nothing
+        # is listening for the `pre_save`/`post_save` it won't send.
+        qs = self.queryset(request).filter(pk=kwargs.get(pkfield))
+        changed = self.changed_fields(attrs)
+
+        if changed:
+            found = qs.update(**changed)
+        else:
+            found = qs.exists()
+
+        if not found:
             return rc.NOT_FOUND
-        except MultipleObjectsReturned: # should never happen, since we're using a PK
-            return rc.BAD_REQUEST
 
-        attrs = self.flatten_dict(request.data)
-        for k,v in attrs.iteritems():
-            setattr( inst, k, v )
+        return rc.ALL_OK
+
+    def saves_instances(self):
+        """
+        Returns whether updates have to go through `save`: when the
+        model overrides it, or has `pre_save`/`post_save` receivers,
+        e.g. for cache invalidation or search indexing, which a
+        plain UPDATE wouldn't notify.
+        """
+        return self.model.save.im_func is not Model.save.im_func \
+            or has_listeners(pre_save, self.model) \
+            or has_listeners(post_save, self.model)
+
+    def save_instance(self, inst, attrs):
+        """
+        Saves `inst` once `attrs` were set on it. Unless the model
+        overrides `save`, which may change other fields, only the
+        changed columns are written where Django supports it.
+        """
+        if SAVE_UPDATE_FIELDS and self.model.save.im_func is Model.save.im_func:
+            fields = self.changed_fields(attrs).keys()
+
+            if fields:
+                inst.save(update_fields=fields)
+                return
 
         inst.save()
-        return rc.ALL_OK
+
+    def changed_fields(self, attrs, touch=True):
+        """
+        Maps the attributes sent by the client onto the model's
+        concrete fields (by name or attname), for `QuerySet.update`.
+        Unknown attributes and the primary key are ignored, like
+        they would be by `save`, and `auto_now` fields are bumped
+        unless `touch` is off.
+        """
+        changed = { }
+
+        # Fields inherited from a multi-table parent are included;
+        # `update` issues a separate UPDATE for the parent's table.
+        for f in self.model._meta.fields:
+            if f.primary_key:
+                continue
+
+            for name in (f.name, f.attname):
+                if name in attrs:
+                    changed[f.name] = attrs[name]
+
+        if changed and touch:
+            changed.update(self.touched_fields())
+
+        return changed
+
+    def touched_fields(self):
+        """
+        Returns the current values of the `auto_now` fields.
+        """
+        touched = { }
+
+        for f in self.model._meta.fields:
+            if getattr(f, 'auto_now', False):
+                touched[f.name] = f.pre_save(self.model(), False)
+
+        return touched
+
+    def partial_update(self, request, *args, **kwargs):
+        """
+        Called for PATCH, which isn't in `allowed_methods` by
+        default. Only the attributes sent in `request.data` are
+        changed, which is what `update` does too, so we reuse it.
+        """
+        return self.update(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
         if not self.has_model():
             raise NotImplementedError
 
+        if isinstance(getattr(request, 'data', None), (list, tuple)):
+            return self.bulk_delete(request, *args, **kwargs)
+
         try:
             inst = self.queryset(request).get(*args, **kwargs)
 
@@ -148,6 +281,171 @@ class BaseHandler(object):
         except self.model.DoesNotExist:
             return rc.NOT_HERE
 
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        Called by `create` when `request.data` is a list. All
+        objects are inserted in a single transaction, and a status
+        is returned for every item, in order. Unlike `create`,
+        there is no duplicate check; a unique constraint violation
+        rolls everything back and results in `rc.DUPLICATE_ENTRY`.
+        """
+        statuses, instances = [ ], [ ]
+
+        for item in request.data:
+            try:
+                instances.append(self.model(**self.flatten_dict(item)))
+                statuses.append({ 'status': 201 })
+            except (AttributeError, TypeError, ValueError):
+                statuses.append({ 'status': 400 })
+
+        try:
+            with atomic():
+                for batch in batched(instances, self.bulk_batch_size):
+                    if hasattr(self.model.objects, 'bulk_create'):
+                        self.model.objects.bulk_create(batch)
+                    else:
+                        for inst in batch:
+                            inst.save()
+        except IntegrityError:
+            return rc.DUPLICATE_ENTRY
+
+        created = iter(instances)
+
+        for status in statuses:
+            if status['status'] == 201:
+                pk = created.next().pk
+
+                if pk is not None:
+                    status['pk'] = pk
+
+        resp = rc.CREATED
+        resp.content = statuses
+        return resp
+
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        Called by `update` when `request.data` is a list of objects,
+        each carrying its primary key, and run in a single transaction.
+        Objects sending the same changes are updated together, with one
+        UPDATE per batch. If the model has a custom `save` or receivers
+        for its signals, objects are fetched one batch at a time and
+        saved one by one instead.
+        """
+        pkfield = self.model._meta.pk
+        statuses, changes = [ ], [ ]
+
+        for item in request.data:
+            try:
+                attrs = self.flatten_dict(item)
+                pk = pkfield.to_python(attrs.pop(pkfield.name))
+                hash(pk)
+            except (AttributeError, KeyError, TypeError, ValidationError):
+                statuses.append({ 'status': 400 })
+            else:
+                statuses.append({ 'status': 404, 'pk': pk })
+                changes.append((statuses[-1], pk, attrs))
+
+        saves = self.saves_instances()
+
+        try:
+            with atomic():
+                for batch in batched(changes, self.bulk_batch_size):
+                    if saves:
+                        self.save_batch(request, batch)
+                    else:
+                        self.update_batch(request, batch)
+        except IntegrityError:
+            return rc.DUPLICATE_ENTRY
+
+        resp = rc.ALL_OK
+        resp.content = statuses
+        return resp
+
+    def save_batch(self, request, batch):
+        instances = self.queryset(request).in_bulk([ pk for _, pk, _ in batch ])
+
+        for status, pk, attrs in batch:
+            inst = instances.get(pk)
+
+            if inst is None:
+                continue
+
+            for k, v in attrs.iteritems():
+                setattr(inst, k, v)
+
+            self.save_instance(inst, attrs)
+            status['status'] = 200
+
+    def update_batch(self, request, batch):
+        """
+        Updates a batch of `(status, pk, attrs)` with one UPDATE
+        for every distinct set of changes, after one query to
+        find out which of the objects exist.
+        """
+        qs = self.queryset(request)
+        found = set(qs.filter(pk__in=[ pk for _, pk, _ in batch ])
+                      .values_list('pk', flat=True))
+        groups, singles = { }, [ ]
+
+        for status, pk, attrs in batch:
+            if pk not in found:
+                continue
+
+            status['status'] = 200
+            changed = self.changed_fields(attrs, touch=False)
+
+            if not changed:
+                continue
+
+            try:
+                groups.setdefault(tuple(sorted(changed.items())), [ ]).append(pk)
+            except TypeError:
+                # Unhashable values, e.g. lists, are updated alone.
+                singles.append((changed, [ pk ]))
+
+        touched = self.touched_fields()
+
+        for changed, pks in [ (dict(k), v) for k, v in groups.iteritems() ] + singles:
+            changed.update(touched)
+            qs.filter(pk__in=pks).update(**changed)
+
+    def bulk_delete(self, request, *args, **kwargs):
+        """
+        Called by `delete` when `request.data` is a list of primary
+        keys (or of objects carrying one). Every batch is deleted
+        with a single `filter(pk__in=...)` query.
+        """
+        pkfield = self.model._meta.pk
+        statuses, pks = [ ], [ ]
+
+        for item in request.data:
+            try:
+                if isinstance(item, dict):
+                    item = item[pkfield.name]
+                pk = pkfield.to_python(item)
+                hash(pk)
+            except (KeyError, TypeError, ValidationError):
+                statuses.append({ 'status': 400 })
+            else:
+                statuses.append({ 'status': 410, 'pk': pk })
+                pks.append(pk)
+
+        deleted = set()
+
+        with atomic():
+            for batch in batched(pks, self.bulk_batch_size):
+                qs = self.queryset(request).filter(pk__in=batch)
+                deleted.update(qs.values_list('pk', flat=True))
+                qs.delete()
+
+        for status in statuses:
+            if status.get('pk') in deleted:
+                status['status'] = 204
+
+        resp = rc.ALL_OK
+        resp.content = statuses
+        return resp
+
 class AnonymousBaseHandler(BaseHandler):
     """
     Anonymous handler.
@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from piston.authentication.oauth.store.nonces import ModelNonceChecker, nonce_window
+
+
+class Command(NoArgsCommand):
+    help = "Deletes OAuth nonces older than PISTON_OAUTH_NONCE_WINDOW seconds."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='How many nonces to delete per query.'),
+    )
+
+    def handle_noargs(self, **options):
+        checker = ModelNonceChecker(nonce_window())
+        deleted = checker.purge(batch_size=options['batch_size'])
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("Deleted %d expired nonces.\n" % deleted)
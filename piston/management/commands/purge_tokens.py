@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from piston.models import Token
+
+
+class Command(NoArgsCommand):
+    help = "Deletes OAuth tokens older than PISTON_OAUTH_REQUEST_TOKEN_TTL or PISTON_OAUTH_ACCESS_TOKEN_TTL seconds."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='How many tokens to delete per query.'),
+    )
+
+    def handle_noargs(self, **options):
+        deleted = Token.objects.purge(batch_size=options['batch_size'])
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("Deleted %d expired tokens.\n" % deleted)
@@ -1,20 +1,82 @@
-from django.db import models
-from django.contrib.auth.models import User
+from __future__ import with_statement
+
+import os
+import time
+import base64
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import models, router, transaction, IntegrityError
+
+@contextmanager
+def joined():
+    yield
+
+def in_transaction(using):
+    """
+    Returns a context manager running its block in a transaction.
+    That's `atomic` where Django has it, as it nests. Before Django
+    1.6, `commit_on_success` would commit a caller's transaction
+    when leaving the block, so a block under transaction management
+    joins the transaction it's in, and only gets its own otherwise.
+    """
+    if hasattr(transaction, 'atomic'):
+        return transaction.atomic(using=using)
+
+    if transaction.is_managed(using=using):
+        return joined()
+
+    return transaction.commit_on_success(using=using)
 
 KEY_SIZE = 18
 SECRET_SIZE = 32
 
+def generate_random(length=SECRET_SIZE):
+    """
+    Returns `length` random letters, digits, dashes and underscores,
+    read from `os.urandom`.
+    """
+    return base64.urlsafe_b64encode(os.urandom(length))[:length]
+
+def save_with_random_codes(obj, using=None, attempts=5):
+    """
+    Gives `obj` a random key and secret and saves it. Keys are long
+    enough not to collide in practice, so they aren't looked up first;
+    if one does, the unique constraint on `key` refuses it, and a new
+    key is tried.
+    """
+    if using is None:
+        using = router.db_for_write(obj.__class__, instance=obj)
+
+    # The savepoints need a transaction around them, or the save
+    # commits in autocommit mode and takes the savepoint with it.
+    with in_transaction(using):
+        for attempt in range(attempts):
+            obj.key = generate_random(KEY_SIZE)
+            obj.secret = generate_random(SECRET_SIZE)
+
+            sid = transaction.savepoint(using=using)
+            try:
+                obj.save(using=using)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=using)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                transaction.savepoint_commit(sid, using=using)
+                return obj
+
 class KeyManager(models.Manager):
     '''Add support for random key/secret generation
     '''
     def generate_random_codes(self):
-        key = User.objects.make_random_password(length=KEY_SIZE)
-        secret = User.objects.make_random_password(length=SECRET_SIZE)
+        return generate_random(KEY_SIZE), generate_random(SECRET_SIZE)
 
-        while self.filter(key__exact=key, secret__exact=secret).count():
-            secret = User.objects.make_random_password(length=SECRET_SIZE)
-
-        return key, secret
+    def create_with_random_codes(self, **kwargs):
+        """
+        Creates an object with a random key and secret in a single insert.
+        """
+        return save_with_random_codes(self.model(**kwargs), using=self.db)
 
 
 class ConsumerManager(KeyManager):
@@ -22,7 +84,11 @@ class ConsumerManager(KeyManager):
         """
         Shortcut to create a consumer with random key/secret.
         """
-        consumer, created = self.get_or_create(name=name)
+        try:
+            consumer = self.get(name=name)
+        except self.model.DoesNotExist:
+            return self.create_with_random_codes(name=name, user=user,
+                                                 description=description or '')
 
         if user:
             consumer.user = user
@@ -30,10 +96,6 @@ class ConsumerManager(KeyManager):
         if description:
             consumer.description = description
 
-        if created:
-            consumer.key, consumer.secret = self.generate_random_codes()
-            consumer.save()
-
         return consumer
 
     _default_consumer = None
@@ -55,14 +117,90 @@ class TokenManager(KeyManager):
         """
         Shortcut to create a token with random key/secret.
         """
-        token, created = self.get_or_create(consumer=consumer, 
-                                            token_type=token_type, 
-                                            timestamp=timestamp,
-                                            user=user)
+        return self.create_with_random_codes(consumer=consumer,
+                                             token_type=token_type,
+                                             timestamp=timestamp,
+                                             user=user)
+
+    def create_tokens(self, consumer, token_type, count, timestamp=None, user=None, batch_size=1000):
+        """
+        Issues `count` tokens at once, e.g. for load tests or migrations,
+        and returns them. Uses `bulk_create` where Django has it, with one
+        insert per `batch_size` tokens, or one transaction per batch
+        otherwise. `bulk_create` sends no `post_save` signals and may not
+        set primary keys on the returned tokens.
+        """
+        if timestamp is None:
+            timestamp = long(time.time())
+
+        tokens = [ ]
+
+        for start in range(0, count, batch_size):
+            batch = [ self.model(consumer=consumer, token_type=token_type,
+                                 timestamp=timestamp, user=user,
+                                 key=generate_random(KEY_SIZE),
+                                 secret=generate_random(SECRET_SIZE))
+                      for i in range(min(batch_size, count - start)) ]
+
+            if hasattr(self, 'bulk_create'):
+                self.bulk_create(batch)
+            else:
+                with in_transaction(self.db):
+                    for token in batch:
+                        token.save(force_insert=True, using=self.db)
+
+            tokens.extend(batch)
+
+        return tokens
+
+    def ttl(self, token_type):
+        """
+        Returns how many seconds tokens of `token_type` are valid for, set by
+        `PISTON_OAUTH_REQUEST_TOKEN_TTL` (an hour by default) and
+        `PISTON_OAUTH_ACCESS_TOKEN_TTL` (forever by default), or None.
+        """
+        if token_type == self.model.REQUEST:
+            return getattr(settings, 'PISTON_OAUTH_REQUEST_TOKEN_TTL', 3600)
+
+        return getattr(settings, 'PISTON_OAUTH_ACCESS_TOKEN_TTL', None)
+
+    def expired(self, now=None):
+        """
+        Returns the tokens whose TTL ran out.
+        """
+        if now is None:
+            now = time.time()
+
+        query = None
+
+        for token_type, name in self.model.TOKEN_TYPES:
+            ttl = self.ttl(token_type)
+
+            if ttl is not None:
+                q = models.Q(token_type=token_type, timestamp__lt=int(now) - ttl)
+
+                if query is None:
+                    query = q
+                else:
+                    query |= q
+
+        if query is None:
+            return self.none()
+
+        return self.filter(query)
+
+    def purge(self, now=None, batch_size=1000):
+        """
+        Deletes expired tokens in batches of `batch_size`.
+        Returns the number of tokens deleted.
+        """
+        expired = self.expired(now)
+        deleted = 0
 
-        if created:
-            token.key, token.secret = self.generate_random_codes()
-            token.save()
+        while True:
+            pks = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
 
-        return token
-        
+            self.filter(pk__in=pks).delete()
+            deleted += len(pks)
@@ -7,7 +7,7 @@ from django.contrib.auth.models import User
 from django.core.mail import send_mail, mail_admins
 
 # Piston imports
-from managers import TokenManager, ConsumerManager, ResourceManager
+from managers import TokenManager, ConsumerManager, ResourceManager, generate_random, save_with_random_codes
 from signals import consumer_post_save, consumer_post_delete
 
 KEY_SIZE = 18
@@ -21,13 +21,17 @@ CONSUMER_STATES = (
     ('rejected', 'Rejected')
 )
 
-def generate_random(length=SECRET_SIZE):
-    return User.objects.make_random_password(length=length)
+def current_timestamp():
+    return long(time.time())
 
 class Nonce(models.Model):
     token_key = models.CharField(max_length=KEY_SIZE)
     consumer_key = models.CharField(max_length=KEY_SIZE)
     key = models.CharField(max_length=255)
+    timestamp = models.IntegerField(default=0, db_index=True)
+
+    class Meta:
+        unique_together = (('consumer_key', 'token_key', 'key'),)
     
     def __unicode__(self):
         return u"Nonce %s for %s" % (self.key, self.consumer_key)
@@ -37,7 +41,7 @@ class Consumer(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
 
-    key = models.CharField(max_length=KEY_SIZE)
+    key = models.CharField(max_length=KEY_SIZE, unique=True)
     secret = models.CharField(max_length=SECRET_SIZE)
 
     status = models.CharField(max_length=16, choices=CONSUMER_STATES, default='pending')
@@ -59,15 +63,7 @@ class Consumer(models.Model):
         c.user = some_user_object
         c.generate_random_codes()
         """
-        key = User.objects.make_random_password(length=KEY_SIZE)
-        secret = generate_random(SECRET_SIZE)
-
-        while Consumer.objects.filter(key__exact=key, secret__exact=secret).count():
-            secret = generate_random(SECRET_SIZE)
-
-        self.key = key
-        self.secret = secret
-        self.save()
+        save_with_random_codes(self)
 
 
 class Token(models.Model):
@@ -75,11 +71,11 @@ class Token(models.Model):
     ACCESS = 2
     TOKEN_TYPES = ((REQUEST, u'Request'), (ACCESS, u'Access'))
     
-    key = models.CharField(max_length=KEY_SIZE)
+    key = models.CharField(max_length=KEY_SIZE, unique=True)
     secret = models.CharField(max_length=SECRET_SIZE)
     verifier = models.CharField(max_length=VERIFIER_SIZE)
     token_type = models.IntegerField(choices=TOKEN_TYPES)
-    timestamp = models.IntegerField(default=long(time.time()))
+    timestamp = models.IntegerField(default=current_timestamp, db_index=True)
     is_approved = models.BooleanField(default=False)
     
     user = models.ForeignKey(User, null=True, blank=True, related_name='tokens')
@@ -108,16 +104,22 @@ class Token(models.Model):
 
         return urllib.urlencode(token_dict)
 
-    def generate_random_codes(self):
-        key = User.objects.make_random_password(length=KEY_SIZE)
-        secret = generate_random(SECRET_SIZE)
+    def is_expired(self, now=None):
+        """
+        Returns whether the token outlived its TTL, see `TokenManager.ttl`.
+        """
+        ttl = Token.objects.ttl(self.token_type)
+
+        if ttl is None:
+            return False
 
-        while Token.objects.filter(key__exact=key, secret__exact=secret).count():
-            secret = generate_random(SECRET_SIZE)
+        if now is None:
+            now = time.time()
 
-        self.key = key
-        self.secret = secret
-        self.save()
+        return int(self.timestamp) < int(now) - ttl
+
+    def generate_random_codes(self):
+        save_with_random_codes(self)
         
     # -- OAuth 1.0a stuff
 
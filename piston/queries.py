@@ -0,0 +1,174 @@
+from __future__ import with_statement
+
+import re
+import logging
+
+from django.db import connections
+
+from signals import queries_counted
+
+logger = logging.getLogger('piston.queries')
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LISTS = re.compile(r'\bIN \((?:\?, )*\?\)', re.I)
+
+def query_shape(sql):
+    """
+    Reduces `sql` to its shape by replacing literals with `?`,
+    so that queries only differing in their parameters, like
+    the ones an N+1 pattern causes, compare equal.
+    """
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    return IN_LISTS.sub('IN (...)', sql)
+
+class NullTracker(object):
+    """
+    Stand-in for `QueryTracker` on requests which aren't
+    sampled, so instrumented code costs close to nothing.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def wrap(self, name, func):
+        return func
+
+    def start(self):
+        pass
+
+    def finish(self, request, handler):
+        pass
+
+null_tracker = NullTracker()
+
+class QueryTracker(object):
+    """
+    Counts the queries run while handling a request, split
+    into the `handler` and `construct` phases, and remembers
+    which field was being emitted when each one was run.
+
+    Shapes which are run `threshold` times or more within a
+    phase are reported through the `queries_counted` signal
+    and logged as warnings on the `piston.queries` logger.
+    """
+    enabled = True
+
+    def __init__(self, threshold=5):
+        self.threshold = threshold
+        self.counts = { }
+        self.shapes = { }
+        self._marks = { }
+        self._debug = { }
+        self._phase = None
+        self._path = [ ]
+
+    def start(self):
+        """
+        Makes every connection log its queries, whether or
+        not `DEBUG` is on, and marks where the log ends now.
+        """
+        for conn in connections.all():
+            self._debug[conn.alias] = conn.use_debug_cursor
+            conn.use_debug_cursor = True
+            self._marks[conn.alias] = len(conn.queries)
+
+    def stop(self):
+        self.collect()
+
+        for conn in connections.all():
+            if conn.alias in self._debug:
+                conn.use_debug_cursor = self._debug.pop(conn.alias)
+
+    def collect(self):
+        """
+        Attributes the queries logged since the last call to
+        the current phase and field path. Queries run outside
+        of any phase, e.g. during authentication, are skipped.
+        """
+        path = '.'.join(self._path)
+
+        for conn in connections.all():
+            queries = conn.queries
+            start = self._marks.get(conn.alias, 0)
+            self._marks[conn.alias] = len(queries)
+
+            if self._phase is None:
+                continue
+
+            for query in queries[start:]:
+                self.counts[self._phase] = self.counts.get(self._phase, 0) + 1
+
+                key = (self._phase, query_shape(query['sql']))
+                count, paths = self.shapes.get(key, (0, set()))
+                paths.add(path)
+                self.shapes[key] = (count + 1, paths)
+
+    def phase(self, name):
+        return QueryPhase(self, name)
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def push(self, name):
+        self.collect()
+        self._path.append(name)
+
+    def pop(self):
+        self.collect()
+        self._path.pop()
+
+    def repeated(self):
+        """
+        Returns `(phase, shape, count, paths)` for the shapes
+        run at least `threshold` times, most frequent first.
+        """
+        found = [ (phase, shape, count, sorted(paths))
+                  for (phase, shape), (count, paths) in self.shapes.iteritems()
+                  if count >= self.threshold ]
+
+        found.sort(key=lambda r: -r[2])
+        return found
+
+    def finish(self, request, handler):
+        """
+        Stops tracking and reports what was found.
+        """
+        self.stop()
+        repeated = self.repeated()
+
+        for phase, shape, count, paths in repeated:
+            logger.warning("%s ran %d similar queries during %s (fields: %s): %s",
+                           handler.__class__.__name__, count, phase,
+                           ', '.join([ p or '-' for p in paths ]), shape)
+
+        queries_counted.send(sender=handler.__class__, request=request,
+                             handler=handler, counts=self.counts,
+                             repeated=repeated)
+
+class QueryPhase(object):
+    def __init__(self, tracker, name):
+        self.tracker = tracker
+        self.name = name
+
+    def __enter__(self):
+        self.tracker.collect()
+        self.outer = self.tracker._phase
+        self.tracker._phase = self.name
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracker.collect()
+        self.tracker._phase = self.outer
+        return False
@@ -0,0 +1,135 @@
+from __future__ import with_statement
+
+import time
+import Queue
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+
+from utils import LRUCache
+
+logger = logging.getLogger('piston.reporting')
+
+def fingerprint(exc_type, tb):
+    """
+    Identifies a crash by the type of exception and the
+    place it was raised from, so repeats of the same bug
+    share a fingerprint regardless of the data involved.
+    """
+    frames = traceback.extract_tb(tb)
+
+    if frames:
+        filename, lineno, name, _ = frames[-1]
+    else:
+        filename, lineno, name = None, None, None
+
+    return (exc_type.__module__, exc_type.__name__, filename, lineno, name)
+
+class CrashReporter(object):
+    """
+    Hands crash reports to a background thread, so that a
+    failing request doesn't wait on the mail server.
+
+    A fingerprint is only reported once per `window` seconds,
+    and at most `queue_size` reports wait to be sent at any
+    time; further reports are dropped and counted instead.
+    """
+    def __init__(self, window=300, queue_size=50, maxsize=1024):
+        self.window = window
+        self.queue = Queue.Queue(queue_size)
+        self.seen = LRUCache(maxsize)
+        self.suppressed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def should_report(self, key):
+        """
+        Returns whether `key` wasn't reported within the
+        window, and marks it as reported now if so.
+        """
+        now = time.time()
+
+        with self._lock:
+            last = self.seen.get(key)
+
+            if last is not None and now - last < self.window:
+                self.suppressed += 1
+                return False
+
+            self.seen.set(key, now)
+            return True
+
+    def submit(self, key, func, *args):
+        """
+        Queues `func(*args)` to be called in the background,
+        unless `key` was reported recently or the queue is
+        full. Returns whether the report was queued.
+        """
+        if not self.should_report(key):
+            return False
+
+        return self.send(func, *args)
+
+    def send(self, func, *args):
+        """
+        Queues `func(*args)` like `submit`, for callers which
+        checked `should_report` themselves, e.g. to only do the
+        work of building a report when it's going to be sent.
+        """
+        try:
+            self.queue.put_nowait((func, args))
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        self.start()
+        return True
+
+    def start(self):
+        if self._worker is not None:
+            return
+
+        with self._lock:
+            if self._worker is None:
+                worker = threading.Thread(target=self.run, name='piston-crash-reporter')
+                worker.setDaemon(True)
+                worker.start()
+                self._worker = worker
+
+    def run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Failed to send crash report")
+            self.queue.task_done()
+
+    def flush(self):
+        """
+        Blocks until every queued report has been sent.
+        """
+        self.queue.join()
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_reporter():
+    """
+    Returns the process-wide `CrashReporter`, configured with
+    `PISTON_CRASH_REPORT_WINDOW` and `PISTON_CRASH_REPORT_QUEUE`.
+    """
+    global _default
+
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = CrashReporter(
+                    window=getattr(settings, 'PISTON_CRASH_REPORT_WINDOW', 300),
+                    queue_size=getattr(settings, 'PISTON_CRASH_REPORT_QUEUE', 50))
+
+    return _default
@@ -1,9 +1,11 @@
-import sys, inspect
+from __future__ import with_statement
+
+import sys, inspect, random
 
 from django.http import (HttpResponse, Http404, HttpResponseNotAllowed,
     HttpResponseForbidden, HttpResponseServerError)
 from django.views.debug import ExceptionReporter
-from django.views.decorators.vary import vary_on_headers
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.conf import settings
 from django.core.mail import send_mail, EmailMessage
 from django.db.models.query import QuerySet
@@ -13,8 +15,13 @@ from emitters import Emitter
 from handler import typemapper
 from doc import HandlerMethod
 from authentication import NoAuthentication
+from timing import PhaseTimer, null_timer
+from queries import QueryTracker, null_tracker
+from reporting import default_reporter, fingerprint
 from utils import coerce_put_post, FormValidationError, HttpStatusCode
-from utils import rc, format_error, translate_mime, MimerDataException
+from utils import rc, format_error, translate_mime, has_body, MimerDataException
+from utils import FilteredQueryDict, LazyQueryDict, MimerDataTooLarge, throttled
+from throttling import get_engine, identify, identify_unverified
 
 CHALLENGE = object()
 
@@ -25,11 +32,19 @@ class Resource(object):
     the handler. The second argument is optional, and
     is an authentication handler. If not specified,
     `NoAuthentication` will be used by default.
+
+    `throttle` optionally limits the resource to a number
+    of requests per number of seconds, as a tuple. Refer to
+    `Resource.throttle_request`. `pre_throttle` is the limit
+    per IP address before authentication, which defaults to
+    `throttle` with `PISTON_THROTTLE_PRE_MULTIPLIER` times
+    as many requests.
     """
     callmap = { 'GET': 'read', 'POST': 'create',
-                'PUT': 'update', 'DELETE': 'delete' }
+                'PUT': 'update', 'PATCH': 'partial_update',
+                'DELETE': 'delete' }
 
-    def __init__(self, handler, authentication=None):
+    def __init__(self, handler, authentication=None, throttle=None, pre_throttle=None):
         if not callable(handler):
             raise AttributeError, "Handler not callable."
 
@@ -43,10 +58,27 @@ class Resource(object):
         else:
             self.authentication = (authentication,)
 
+        if throttle:
+            if not pre_throttle:
+                multiplier = getattr(settings, 'PISTON_THROTTLE_PRE_MULTIPLIER', 10)
+                pre_throttle = (throttle[0] * multiplier,) + tuple(throttle[1:])
+
+            self.throttle = get_engine()(*throttle)
+            self.pre_throttle = get_engine()(*pre_throttle)
+        else:
+            self.throttle = self.pre_throttle = None
+
         # Erroring
         self.email_errors = getattr(settings, 'PISTON_EMAIL_ERRORS', True)
         self.display_errors = getattr(settings, 'PISTON_DISPLAY_ERRORS', True)
         self.stream = getattr(settings, 'PISTON_STREAM_OUTPUT', False)
+        self.crash_reporter = default_reporter()
+
+        # Instrumentation
+        self.server_timing = getattr(settings, 'PISTON_SERVER_TIMING', False)
+        self.timing = self.server_timing or getattr(settings, 'PISTON_TIMING', False)
+        self.query_sample_rate = getattr(settings, 'PISTON_QUERY_SAMPLE_RATE', 0)
+        self.query_threshold = getattr(settings, 'PISTON_QUERY_REPEAT_THRESHOLD', 5)
 
     def determine_emitter(self, request, *args, **kwargs):
         """
@@ -54,14 +86,17 @@ class Resource(object):
         for output. It lives here so you can easily subclass
         `Resource` in order to change how emission is detected.
 
-        You could also check for the `Accept` HTTP header here,
-        since that pretty much makes sense. Refer to `Mimer` for
-        that as well.
+        An explicit `emitter_format` or `?format=` wins, after
+        which the `Accept` HTTP header is negotiated against the
+        registered emitters. Refer to `Emitter.negotiate`.
         """
         em = kwargs.pop('emitter_format', None)
 
         if not em:
-            em = request.GET.get('format', 'json')
+            em = request.GET.get('format', None)
+
+        if not em:
+            em = Emitter.negotiate(request.META.get('HTTP_ACCEPT', None))
 
         return em
 
@@ -95,9 +130,31 @@ class Resource(object):
 
         return None
 
+    def accepts(self, authenticator):
+        """
+        Returns whether `authenticator` itself is among the
+        authenticators of this resource. Another instance of the
+        same class doesn't count, since it may check credentials
+        differently, e.g. with another `auth_func` or realm.
+        """
+        if authenticator is None:
+            return False
+
+        for candidate in self.authentication:
+            if candidate is authenticator:
+                return True
+
+        return False
+
     def authenticate(self, request, rm):
         actor, anonymous = False, True
 
+        # Requests dispatched by `BatchHandler` carry the
+        # authenticator which already accepted the batch. It
+        # only counts if this resource would have used it too.
+        if self.accepts(getattr(request, 'authenticator', None)):
+            return self.handler, self.handler.is_anonymous
+
         for authenticator in self.authentication:
             if not authenticator.is_authenticated(request):
                 if self.anonymous and \
@@ -107,41 +164,88 @@ class Resource(object):
                 else:
                     actor, anonymous = authenticator.challenge, CHALLENGE
             else:
+                if not isinstance(authenticator, NoAuthentication):
+                    request.authenticator = authenticator
                 return self.handler, self.handler.is_anonymous
 
         return actor, anonymous
 
-    @vary_on_headers('Authorization')
     def __call__(self, request, *args, **kwargs):
         """
         NB: Sends a `Vary` header so we don't cache requests
-        that are different (OAuth stuff in `Authorization` header.)
+        that are different (OAuth stuff in `Authorization` header,
+        and negotiated output in `Accept`.) Responses which may be
+        shared between users only vary on `Accept`.
+        """
+        if self.timing:
+            timer = PhaseTimer()
+        else:
+            timer = null_timer
+
+        resp = self.process(request, timer, *args, **kwargs)
+
+        limit = getattr(request, 'rate_limit', None)
+        if limit is not None:
+            limit.add_headers(resp)
+
+        if getattr(resp, 'shared', False):
+            patch_vary_headers(resp, ('Accept',))
+        else:
+            patch_vary_headers(resp, ('Authorization', 'Accept'))
+
+        return timer.finish(request, resp, self.server_timing)
+
+    def process(self, request, timer, *args, **kwargs):
+        """
+        Does the actual work for `__call__`, timing the
+        authentication, translation, handler, construction
+        and rendering phases with `timer`.
         """
         rm = request.method.upper()
 
+        if self.throttle is not None:
+            with timer.phase('throttle'):
+                refused = self.throttle_request(request, identify_unverified(request), 'pre')
+
+            if refused is not None:
+                return refused
+
         # Django's internal mechanism doesn't pick up
-        # PUT request, so we trick it a little here.
-        if rm == "PUT":
+        # PUT/PATCH requests, so we parse those lazily.
+        if rm in ('PUT', 'PATCH'):
             coerce_put_post(request)
 
-        actor, anonymous = self.authenticate(request, rm)
+        with timer.phase('auth'):
+            actor, anonymous = self.authenticate(request, rm)
 
         if anonymous is CHALLENGE:
             return actor()
         else:
             handler = actor
 
+        if self.throttle is not None:
+            with timer.phase('throttle'):
+                refused = self.throttle_request(request, identify(request), 'post')
+
+            if refused is not None:
+                return refused
+
+        timer.tag(handler)
+
         # Translate nested datastructs into `request.data` here.
-        if rm in ('POST', 'PUT'):
-            try:
-                translate_mime(request)
-            except MimerDataException:
-                return rc.BAD_REQUEST
+        # DELETE requests mostly come without a body, whatever
+        # their `Content-Type` says, so those aren't decoded.
+        if rm in ('POST', 'PUT', 'PATCH', 'DELETE') and not hasattr(request, 'data'):
+            if rm != 'DELETE' or has_body(request):
+                try:
+                    with timer.phase('translate'):
+                        translate_mime(request)
+                except MimerDataTooLarge:
+                    return rc.REQUEST_ENTITY_TOO_LARGE
+                except MimerDataException:
+                    return rc.BAD_REQUEST
             if not hasattr(request, 'data'):
-                if rm == 'POST':
-                    request.data = request.POST
-                else:
-                    request.data = request.PUT
+                request.data = getattr(request, rm, None)
 
         if not rm in handler.allowed_methods:
             return HttpResponseNotAllowed(handler.allowed_methods)
@@ -160,82 +264,188 @@ class Resource(object):
         # don't want to pass these along to the handler.
         request = self.cleanup_request(request)
 
-        try:
-            result = meth(request, *args, **kwargs)
-        except Exception, e:
-            result = self.error_handler(e, request, meth, em_format)
+        # Count the queries of a sample of requests, to
+        # find handlers and fields running N+1 queries.
+        if self.query_sample_rate and random.random() < self.query_sample_rate:
+            tracker = QueryTracker(self.query_threshold)
+        else:
+            tracker = null_tracker
 
+        # Everything from here on runs with the tracker on, so it's
+        # finished, and the connections restored, however we leave.
         try:
-            emitter, ct = Emitter.get(em_format)
-            fields = handler.fields
+            tracker.start()
 
-            if hasattr(handler, 'list_fields') and isinstance(result, (list, tuple, QuerySet)):
-                fields = handler.list_fields
-        except ValueError:
-            result = rc.BAD_REQUEST
-            result.content = "Invalid output format specified '%s'." % em_format
-            return result
+            with timer.phase('handler'):
+                with tracker.phase('handler'):
+                    try:
+                        result = meth(request, *args, **kwargs)
+                    except Exception, e:
+                        result = self.error_handler(e, request, meth, em_format)
 
-        status_code = 200
-
-        # If we're looking at a response object which contains non-string
-        # content, then assume we should use the emitter to format that 
-        # content
-        if isinstance(result, HttpResponse) and not result._is_string:
-            status_code = result.status_code
-            # Note: We can't use result.content here because that method attempts
-            # to convert the content into a string which we don't want. 
-            # when _is_string is False _container is the raw data
-            result = result._container
+            try:
+                emitter, ct = Emitter.get(em_format)
+                fields = handler.fields
+
+                if hasattr(handler, 'list_fields') and isinstance(result, (list, tuple, QuerySet)):
+                    fields = handler.list_fields
+            except ValueError:
+                result = rc.BAD_REQUEST
+                result.content = "Invalid output format specified '%s'." % em_format
+                return result
+
+            status_code = 200
+
+            # If we're looking at a response object which contains non-string
+            # content, then assume we should use the emitter to format that 
+            # content
+            if isinstance(result, HttpResponse) and not result._is_string:
+                status_code = result.status_code
+                # Note: We can't use result.content here because that method attempts
+                # to convert the content into a string which we don't want. 
+                # when _is_string is False _container is the raw data
+                result = result._container
      
-        srl = emitter(result, typemapper, handler, fields, anonymous)
+            srl = emitter(result, typemapper, handler, fields, anonymous)
+            srl.construct = timer.wrap('construct', tracker.wrap('construct', srl.construct))
 
-        try:
-            """
-            Decide whether or not we want a generator here,
-            or we just want to buffer up the entire result
-            before sending it to the client. Won't matter for
-            smaller datasets, but larger will have an impact.
-            """
-            if self.stream: stream = srl.stream_render(request)
-            else: stream = srl.render(request)
+            if tracker.enabled:
+                srl.tracker = tracker
 
-            if not isinstance(stream, HttpResponse):
-                resp = HttpResponse(stream, mimetype=ct, status=status_code)
-            else:
-                resp = stream
+            try:
+                """
+                Decide whether or not we want a generator here,
+                or we just want to buffer up the entire result
+                before sending it to the client. Won't matter for
+                smaller datasets, but larger will have an impact.
+                """
+                with timer.phase('render'):
+                    if self.stream: stream = srl.stream_render(request)
+                    else: stream = srl.render(request)
+
+                if not isinstance(stream, HttpResponse):
+                    resp = HttpResponse(stream, mimetype=ct, status=status_code)
+                else:
+                    resp = stream
 
-            resp.streaming = self.stream
+                resp.streaming = self.stream
 
-            return resp
-        except HttpStatusCode, e:
-            return e.response
+                if rm in ('GET', 'HEAD') and resp.status_code == 200:
+                    self.cache_control(handler, anonymous, resp)
+
+                return resp
+            except HttpStatusCode, e:
+                return e.response
+        finally:
+            tracker.finish(request, handler)
+
+    def throttle_request(self, request, ident, stage):
+        """
+        Counts `request` against the resource's throttle.
+
+        This is done twice: first, before anything else, by
+        the client's IP address (`stage` is `pre`), so floods
+        are refused before their signatures are checked or
+        their bodies are parsed. An address may be shared by
+        many users behind NAT or a proxy, so this counts
+        against the larger `pre_throttle`. Then as who the
+        request turned out to be (`stage` is `post`), after
+        auth, against `throttle`.
+
+        Returns the response to refuse the request with, if
+        it's over the limit.
+        """
+        if not ident:
+            return None
+
+        if stage == 'pre':
+            throttle = self.pre_throttle
+        else:
+            throttle = self.throttle
+
+        limit = throttle.hit('%s:%s' % (stage, ident))
+        request.rate_limit = limit
+
+        if not limit.allowed:
+            return throttled(limit)
+
+    @staticmethod
+    def cache_control(handler, anonymous, resp):
+        """
+        Adds a `Cache-Control` header to `resp` following the
+        `cache_*` attributes of the handler which served it.
+
+        Responses are `private`, unless an anonymous handler
+        with `cache_public` served them. Those are `public`, get
+        `s-maxage` and are marked `shared`, so they don't vary
+        on the `Authorization` header and edge caches can serve
+        them to everyone.
+        """
+        max_age = handler.cache_max_age
+        stale = handler.cache_stale_while_revalidate
+
+        if max_age is None and stale is None and not handler.cache_s_maxage:
+            return
+
+        directives = { }
+
+        if max_age is not None:
+            directives['max_age'] = max_age
+
+        if stale is not None:
+            directives['stale_while_revalidate'] = stale
+
+        if anonymous and handler.cache_public:
+            directives['public'] = True
+
+            if handler.cache_s_maxage is not None:
+                directives['s_maxage'] = handler.cache_s_maxage
+
+            resp.shared = True
+        else:
+            directives['private'] = True
+
+        patch_cache_control(resp, **directives)
 
     @staticmethod
     def cleanup_request(request):
         """
-        Removes `oauth_` keys from various dicts on the
-        request object, and returns the sanitized version.
+        Hides `oauth_` keys in various dicts on the request
+        object, and returns the sanitized version. Dicts are
+        wrapped in a `FilteredQueryDict` view, not copied.
         """
-        for method_type in ('GET', 'PUT', 'POST', 'DELETE'):
-            block = getattr(request, method_type, { })
+        for method_type in ('GET', 'PUT', 'PATCH', 'POST', 'DELETE'):
+            block = getattr(request, method_type, None)
 
-            if True in [ k.startswith("oauth_") for k in block.keys() ]:
-                sanitized = block.copy()
+            if isinstance(block, LazyQueryDict):
+                # Looking inside would parse the body, so
+                # wrap it unseen; the view costs nothing.
+                setattr(request, method_type, FilteredQueryDict(block))
+                continue
 
-                for k in sanitized.keys():
-                    if k.startswith("oauth_"):
-                        sanitized.pop(k)
+            if not block:
+                continue
 
-                setattr(request, method_type, sanitized)
+            for k in block:
+                if k.startswith("oauth_"):
+                    setattr(request, method_type, FilteredQueryDict(block))
+                    break
 
         return request
 
     # --
 
     def email_exception(self, reporter):
+        """
+        Renders `reporter`'s crash report on the request thread,
+        while the request and its frames can still be inspected
+        safely, and has `send_crash_report` mail it in the
+        background.
+        """
+        self.crash_reporter.send(self.send_crash_report, reporter.get_traceback_html())
+
+    def send_crash_report(self, html):
         subject = "Piston crash report"
-        html = reporter.get_traceback_html()
 
         message = EmailMessage(settings.EMAIL_SUBJECT_PREFIX+subject,
                                 html, settings.SERVER_EMAIL,
@@ -245,6 +455,15 @@ class Resource(object):
         message.send(fail_silently=True)
 
 
+    def report_crash(self, reporter, exc_type, tb):
+        """
+        Emails `reporter`'s crash report with `email_exception`,
+        if `PISTON_EMAIL_ERRORS` is on and it isn't suppressed
+        as a repeat.
+        """
+        if self.email_errors and self.crash_reporter.should_report(fingerprint(exc_type, tb)):
+            self.email_exception(reporter)
+
     def error_handler(self, e, request, meth, em_format):
         """
         Override this method to add handling of errors customized for your 
@@ -284,7 +503,9 @@ class Resource(object):
 
             Parameters::
              - `PISTON_EMAIL_ERRORS`: Will send a Django formatted
-               error email to people in `settings.ADMINS`.
+               error email to people in `settings.ADMINS`. This is
+               done in the background, once per kind of crash per
+               `PISTON_CRASH_REPORT_WINDOW` seconds.
              - `PISTON_DISPLAY_ERRORS`: Will return a simple traceback
                to the caller, so he can tell you what error they got.
 
@@ -293,8 +514,7 @@ class Resource(object):
             """
             exc_type, exc_value, tb = sys.exc_info()
             rep = ExceptionReporter(request, exc_type, exc_value, tb.tb_next)
-            if self.email_errors:
-                self.email_exception(rep)
+            self.report_crash(rep, exc_type, tb)
             if self.display_errors:
                 return HttpResponseServerError(
                     format_error('\n'.join(rep.format_exception())))
@@ -4,6 +4,14 @@ import django.dispatch
 # Piston imports
 from utils import send_consumer_mail
 
+# Sent by `Resource` with the seconds spent per phase, when
+# `PISTON_TIMING` or `PISTON_SERVER_TIMING` is enabled.
+request_timed = django.dispatch.Signal(providing_args=['request', 'handler', 'timings'])
+
+# Sent by `Resource` for requests sampled by `PISTON_QUERY_SAMPLE_RATE`,
+# with the queries counted per phase and the repeated query shapes.
+queries_counted = django.dispatch.Signal(providing_args=['request', 'handler', 'counts', 'repeated'])
+
 def consumer_post_save(sender, instance, created, **kwargs):
     send_consumer_mail(instance)
 
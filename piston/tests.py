@@ -1,17 +1,34 @@
+from __future__ import with_statement
+
+import time
+
+import oauth2 as oauth
+
 # Django imports
 from django.core import mail
+from django.core.cache import get_cache
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.template import loader, TemplateDoesNotExist
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, QueryDict
 from django.utils import simplejson
 
 # Piston imports
 from test import TestCase
-from models import Consumer
-from handler import BaseHandler
-from utils import rc
+from models import Consumer, Token
+from handler import BaseHandler, AnonymousBaseHandler
+from authentication import HttpBasicAuthentication
+from utils import rc, throttle, LazyQueryDict, FilteredQueryDict
 from resource import Resource
+from timing import PhaseTimer, aggregator
+from reporting import CrashReporter
+from authentication.oauth.utils import SignatureMethod_HMAC_SHA256, verifier, get_oauth_request
+from authentication.oauth.store import store, InvalidConsumerError, InvalidTokenError
+from authentication.oauth.store.cache import ObjectCache, tokens
+from authentication.oauth.store.cached import CachedStore
+from authentication.oauth.store.memory import MemoryStore
+from authentication.oauth.store.nonces import ModelNonceChecker, CacheNonceChecker
+from throttling import FixedWindow, SlidingWindow, TokenBucket, ApproximateWindow, identify_unverified
 
 class ConsumerTest(TestCase):
     fixtures = ['models.json']
@@ -72,6 +89,275 @@ class ConsumerTest(TestCase):
         self.assertEquals(mail.outbox[0].subject, expected)
 
 
+class ConsumerCacheTest(TestCase):
+    def test_object_cache(self):
+        loads = [ ]
+        def load(key):
+            loads.append(key)
+            return key.upper()
+
+        objects = ObjectCache('test', maxsize=2, ttl=60)
+        self.assertEquals('A', objects.get('a', load))
+        self.assertEquals('A', objects.get('a', load))
+        self.assertEquals(['a'], loads)
+
+        objects.invalidate('a')
+        objects.get('a', load)
+        self.assertEquals(['a', 'a'], loads)
+
+        objects.local.set('b', 'stale', ttl=0)
+        self.assertEquals('B', objects.get('b', load))
+
+    def test_cache_key_is_safe(self):
+        key = ObjectCache('test').cache_key(u'a key\n\xe9' * 100)
+        self.assertTrue(len(key) < 250)
+        self.assertFalse(' ' in key or '\n' in key)
+
+    def test_invalidated_on_save(self):
+        consumer = Consumer.objects.create_consumer('Cached Consumer')
+        cached = store.get_consumer(None, None, consumer.key)
+        self.assertEquals('pending', cached.status)
+
+        consumer.status = 'accepted'
+        consumer.save()
+        self.assertEquals('accepted', store.get_consumer(None, None, consumer.key).status)
+
+        consumer.delete()
+        self.assertRaises(InvalidConsumerError, store.get_consumer, None, None, consumer.key)
+
+class AccessTokenTest(TestCase):
+    def test_single_query(self):
+        consumer = Consumer.objects.create_consumer('Token Consumer')
+        user = User.objects.create_user('token', 'token@example.com', 'token')
+        token = Token.objects.create_token(consumer, Token.ACCESS, 0, user)
+        tokens.clear()
+
+        with self.assertNumQueries(1):
+            loaded = store.get_access_token(None, None, consumer, token.key)
+            self.assertEquals(user, loaded.user)
+            self.assertEquals(consumer, loaded.consumer)
+
+        with self.assertNumQueries(0):
+            cached = store.get_access_token(None, None, consumer, token.key)
+            self.assert_(cached is not store.get_access_token(None, None, consumer, token.key))
+            self.assertFalse(hasattr(cached, '_user_cache'))
+
+        token.delete()
+        self.assertRaises(InvalidTokenError, store.get_access_token,
+                          None, None, consumer, token.key)
+
+    def test_invalidated_with_user_and_consumer(self):
+        consumer = Consumer.objects.create_consumer('Token Consumer')
+        user = User.objects.create_user('token', 'token@example.com', 'token')
+        token = Token.objects.create_token(consumer, Token.ACCESS, 0, user)
+        store.get_access_token(None, None, consumer, token.key)
+
+        user.is_active = False
+        user.save()
+        self.assertFalse(store.get_access_token(None, None, consumer, token.key).user.is_active)
+
+        consumer.status = 'canceled'
+        consumer.save()
+        self.assertEquals('canceled', store.get_access_token(None, None, consumer, token.key).consumer.status)
+
+class CachedStoreTest(TestCase):
+    def setUp(self):
+        self.store = CachedStore(get_cache('django.core.cache.backends.locmem.LocMemCache'))
+        self.consumer = Consumer.objects.create_consumer('Cached Consumer')
+        self.user = User.objects.create_user('cached', 'cached@example.com', 'cached')
+
+    def test_steady_state_queries(self):
+        token = Token.objects.create_token(self.consumer, Token.ACCESS, 0, self.user)
+        oauth_request = {'oauth_consumer_key': self.consumer.key,
+                         'oauth_timestamp': str(int(time.time()))}
+
+        self.store.get_consumer(None, oauth_request, self.consumer.key)
+        self.store.get_access_token(None, oauth_request, self.consumer, token.key)
+
+        with self.assertNumQueries(0):
+            consumer = self.store.get_consumer(None, oauth_request, self.consumer.key)
+            loaded = self.store.get_access_token(None, oauth_request, consumer, token.key)
+            self.assertTrue(self.store.check_nonce(None, oauth_request, 'nonce'))
+            self.assertFalse(self.store.check_nonce(None, oauth_request, 'nonce'))
+
+        # Users aren't cached, but loaded by each request.
+        with self.assertNumQueries(1):
+            self.assertEquals(self.user, self.store.get_user_for_access_token(None, oauth_request, loaded))
+
+    def test_token_exchange(self):
+        oauth_request = {'oauth_timestamp': str(int(time.time()))}
+        request = HttpRequest()
+        request.user = self.user
+
+        token = self.store.create_request_token(request, oauth_request, self.consumer, 'oob')
+
+        with self.assertNumQueries(0):
+            self.assertEquals(token, self.store.get_request_token(request, oauth_request, token.key))
+
+        self.store.authorize_request_token(request, oauth_request, token)
+        self.assertTrue(self.store.get_request_token(request, oauth_request, token.key).is_approved)
+
+        access_token = self.store.create_access_token(request, oauth_request, self.consumer, token)
+        self.assertRaises(InvalidTokenError, self.store.get_request_token,
+                          request, oauth_request, token.key)
+
+        with self.assertNumQueries(0):
+            self.assertEquals(access_token, self.store.get_access_token(
+                request, oauth_request, self.consumer, access_token.key))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.store.get_access_token(
+            request, oauth_request, self.consumer, access_token.key).user.is_active)
+
+    def test_nonces_need_a_shared_cache(self):
+        self.assertTrue(isinstance(self.store.nonce_checker, CacheNonceChecker))
+        self.assertTrue(isinstance(CachedStore().nonce_checker, ModelNonceChecker))
+
+class MemoryStoreTest(TestCase):
+    def test_token_exchange(self):
+        store = MemoryStore()
+        consumer = store.add_consumer('Memory Consumer')
+        oauth_request = {'oauth_timestamp': str(int(time.time()))}
+        request = HttpRequest()
+        request.user = User(username='memory')
+
+        with self.assertNumQueries(0):
+            self.assert_(consumer is store.get_consumer(request, oauth_request, consumer.key))
+            self.assertRaises(InvalidConsumerError, store.get_consumer, request, oauth_request, 'missing')
+
+            token = store.create_request_token(request, oauth_request, consumer, 'http://example.com/cb')
+            self.assert_(token is store.get_request_token(request, oauth_request, token.key))
+            self.assertTrue(store.authorize_request_token(request, oauth_request, token).is_approved)
+            self.assert_(token.get_callback_url().startswith('http://example.com/cb?oauth_verifier='))
+
+            access_token = store.create_access_token(request, oauth_request, consumer, token)
+            self.assertRaises(InvalidTokenError, store.get_request_token, request, oauth_request, token.key)
+            self.assert_(access_token is store.get_access_token(request, oauth_request, consumer, access_token.key))
+            self.assert_(request.user is store.get_user_for_access_token(request, oauth_request, access_token))
+
+    def test_nonces(self):
+        store = MemoryStore()
+        oauth_request = {'oauth_consumer_key': 'consumer', 'oauth_timestamp': str(int(time.time()))}
+
+        self.assertTrue(store.check_nonce(None, oauth_request, 'nonce'))
+        self.assertFalse(store.check_nonce(None, oauth_request, 'nonce'))
+
+        store.clear()
+        self.assertTrue(store.check_nonce(None, oauth_request, 'nonce'))
+
+class KeyGenerationTest(TestCase):
+    def test_create_token(self):
+        consumer = Consumer.objects.create_consumer('Keyed Consumer')
+        self.assertEquals(18, len(consumer.key))
+
+        with self.assertNumQueries(1):
+            token = Token.objects.create_token(consumer, Token.ACCESS, 0)
+
+        self.assertNotEquals(consumer.key, token.key)
+        self.assertEquals(32, len(token.secret))
+
+    def test_key_collision(self):
+        consumer = Consumer.objects.create_consumer('Colliding Consumer')
+        token = Token.objects.create_token(consumer, Token.ACCESS, 0)
+        keys = [ token.key, token.key, 'a' * 18 ]
+
+        def colliding_random(length):
+            if length == 18:
+                return keys.pop(0)
+            return 's' * length
+
+        import managers
+        generate_random = managers.generate_random
+        managers.generate_random = colliding_random
+
+        try:
+            retried = Token.objects.create_token(consumer, Token.ACCESS, 0)
+        finally:
+            managers.generate_random = generate_random
+
+        self.assertEquals('a' * 18, retried.key)
+        self.assertEquals(2, Token.objects.count())
+
+    def test_create_tokens(self):
+        consumer = Consumer.objects.create_consumer('Bulk Consumer')
+        tokens = Token.objects.create_tokens(consumer, Token.ACCESS, 25, batch_size=10)
+
+        self.assertEquals(25, len(tokens))
+        self.assertEquals(25, len(set([ t.key for t in tokens ])))
+        self.assertEquals(25, Token.objects.filter(consumer=consumer).count())
+
+class TokenExpiryTest(TestCase):
+    def test_expired_tokens(self):
+        consumer = Consumer.objects.create_consumer('Expiring Consumer')
+        now = int(time.time())
+        stale = Token.objects.create_token(consumer, Token.REQUEST, now - 7200)
+        fresh = Token.objects.create_token(consumer, Token.REQUEST, now)
+        access = Token.objects.create_token(consumer, Token.ACCESS, now - 7200)
+
+        self.assertTrue(stale.is_expired())
+        self.assertFalse(fresh.is_expired())
+        self.assertFalse(access.is_expired())
+
+        self.assertRaises(InvalidTokenError, store.get_request_token, None, None, stale.key)
+        self.assertEquals(fresh, store.get_request_token(None, None, fresh.key))
+
+        self.assertEquals(1, Token.objects.purge(now=now, batch_size=1))
+        self.assertEquals([ fresh.pk, access.pk ],
+                          sorted(Token.objects.values_list('pk', flat=True)))
+
+class NonceTest(TestCase):
+    def test_model_nonces(self):
+        checker = ModelNonceChecker(300)
+
+        self.assertTrue(checker.check('consumer', '', 'nonce', 1000))
+        self.assertFalse(checker.check('consumer', '', 'nonce', 1000))
+        self.assertTrue(checker.check('consumer', 'token', 'nonce', 1000))
+
+        self.assertEquals(0, checker.purge(now=1300))
+        self.assertEquals(2, checker.purge(now=1301, batch_size=1))
+        self.assertTrue(checker.check('consumer', '', 'nonce', 2000))
+
+    def test_cache_nonces(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        checker = CacheNonceChecker(300, cache)
+        now = int(time.time())
+
+        self.assertTrue(checker.check('consumer', '', 'nonce', now))
+        self.assertFalse(checker.check('consumer', '', 'nonce', now))
+
+    def test_stale_timestamp(self):
+        oauth_request = {'oauth_consumer_key': 'consumer', 'oauth_timestamp': '1000'}
+        self.assertFalse(store.check_nonce(None, oauth_request, 'nonce'))
+
+class VerifierTest(TestCase):
+    def test_hmac_sha256(self):
+        consumer = oauth.Consumer('key', 'secret')
+        request = oauth.Request.from_consumer_and_token(consumer, None, 'GET', 'http://testserver/api')
+        request.sign_request(SignatureMethod_HMAC_SHA256(), consumer, None)
+
+        self.assertTrue(verifier.verify(request, consumer))
+        self.assertFalse(verifier.verify(request, oauth.Consumer('key', 'other')))
+
+    def test_signed_form_put(self):
+        consumer = oauth.Consumer('key', 'secret')
+        signed = oauth.Request.from_consumer_and_token(consumer, None, 'PUT',
+            'http://testserver/api?page=2', {'title': 'Hello world'})
+        signed.sign_request(oauth.SignatureMethod_HMAC_SHA1(), consumer, None)
+
+        request = HttpRequest()
+        request.method = 'PUT'
+        request.path = '/api'
+        request.META = {'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                        'QUERY_STRING': 'page=2',
+                        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                        'HTTP_AUTHORIZATION': signed.to_header(realm='API')['Authorization']}
+        request._raw_post_data = 'title=Hello+world'
+
+        oauth_request = get_oauth_request(request)
+        self.assertEquals('Hello world', oauth_request['title'])
+        self.assertTrue(verifier.verify(oauth_request, consumer))
+
 class CustomResponseWithStatusCodeTest(TestCase):
      """
      Test returning content to be formatted and a custom response code from a 
@@ -196,3 +482,279 @@ class ErrorHandlerTest(TestCase):
 
         self.assertTrue(isinstance(response, HttpResponse), "Expected a response, not: %s" 
             % response)
+
+    def test_crash_reports_are_deduplicated(self):
+        """
+        Verify that repeats of a crash are only reported once per
+        window, and that the report is sent in the background
+        """
+        class MyHandler(BaseHandler):
+            def read(self, request):
+                raise ValueError()
+
+        sent = [ ]
+        resource = Resource(MyHandler)
+        resource.display_errors = True
+        resource.email_errors = True
+        resource.send_crash_report = sent.append
+        resource.crash_reporter = CrashReporter(window=60)
+
+        for i in range(3):
+            request = HttpRequest()
+            request.method = 'GET'
+            self.assertEquals(500, resource(request).status_code)
+
+        resource.crash_reporter.flush()
+        self.assertEquals(1, len(sent))
+        self.assertTrue('ValueError' in sent[0])
+        self.assertEquals(2, resource.crash_reporter.suppressed)
+
+
+class AcceptsTest(TestCase):
+    def test_only_the_same_authenticator(self):
+        auth = HttpBasicAuthentication(realm='Test')
+        resource = Resource(BaseHandler, authentication=auth)
+
+        self.assertTrue(resource.accepts(auth))
+        self.assertFalse(resource.accepts(HttpBasicAuthentication(realm='Test')))
+        self.assertFalse(resource.accepts(None))
+
+class StatusResponseTest(TestCase):
+    def test_fresh_response_per_access(self):
+        first, second = rc.NOT_FOUND, rc.NOT_FOUND
+
+        self.assertFalse(first is second)
+        self.assertTrue(first.__class__ is second.__class__)
+        self.assertEquals(404, first.status_code)
+
+        first.content = {'error': 'gone'}
+        self.assertFalse(first._is_string)
+        self.assertEquals('Not Found', second.content)
+
+    def test_unknown_code(self):
+        self.assertRaises(AttributeError, getattr, rc, 'NO_SUCH_CODE')
+
+class CacheControlTest(TestCase):
+    def test_public_anonymous_response(self):
+        class AnonHandler(AnonymousBaseHandler):
+            cache_max_age = 60
+            cache_s_maxage = 600
+            cache_public = True
+
+            def read(self, request):
+                return {'msg': 'hello'}
+
+        class MyHandler(BaseHandler):
+            allowed_methods = ('GET',)
+            anonymous = AnonHandler
+
+        resource = Resource(MyHandler, authentication=HttpBasicAuthentication())
+
+        request = HttpRequest()
+        request.method = 'GET'
+        response = resource(request, emitter_format='json')
+
+        directives = set(response['Cache-Control'].split(', '))
+        self.assertEquals(set(['public', 'max-age=60', 's-maxage=600']), directives)
+        self.assertEquals('Accept', response['Vary'])
+
+    def test_private_response(self):
+        class MyHandler(BaseHandler):
+            allowed_methods = ('GET',)
+            cache_max_age = 60
+            cache_s_maxage = 600
+            cache_public = True
+
+            def read(self, request):
+                return {'msg': 'hello'}
+
+        request = HttpRequest()
+        request.method = 'GET'
+        response = Resource(MyHandler)(request, emitter_format='json')
+
+        directives = set(response['Cache-Control'].split(', '))
+        self.assertEquals(set(['private', 'max-age=60']), directives)
+        self.assertTrue('Authorization' in response['Vary'])
+
+class ThrottleTest(TestCase):
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+
+    def test_engines(self):
+        for engine in (FixedWindow, SlidingWindow, TokenBucket, ApproximateWindow):
+            throttle = engine(2, 60, cache=self.cache)
+            allowed = [ throttle.hit('engines', 1000 + i).allowed for i in range(3) ]
+            self.assertEquals([True, True, False], allowed)
+
+    def test_approximate_workers_share_limit(self):
+        workers = [ ApproximateWindow(100, 60, cache=self.cache, tolerance=0.1)
+                    for i in range(2) ]
+
+        allowed = 0
+        for i in range(150):
+            for worker in workers:
+                allowed += worker.hit('workers', 1000 + i * 0.001).allowed
+
+        self.assertEquals(100, allowed)
+
+    def test_approximate_flush(self):
+        worker = ApproximateWindow(100, 60, cache=self.cache, tolerance=0.1, flush_interval=60)
+
+        for i in range(5):
+            worker.hit('flush', 1000)
+
+        self.assertEquals(1, self.cache.get(worker.key('flush', 960)))
+
+        worker.flush(now=1000)
+        self.assertEquals(5, self.cache.get(worker.key('flush', 960)))
+
+    def test_unverified_identity_ignores_claimed_consumer(self):
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '10.0.0.7'
+        request.META['HTTP_AUTHORIZATION'] = 'OAuth oauth_consumer_key="random"'
+        self.assertEquals('10.0.0.7', identify_unverified(request))
+
+    def test_rate_limit_headers(self):
+        class MyHandler(BaseHandler):
+            allowed_methods = ('GET',)
+
+            @throttle(1, 60, extra='test_rate_limit_headers')
+            def read(self, request):
+                return {'msg': 'hello'}
+
+        resource = Resource(MyHandler)
+        responses = [ ]
+
+        for i in range(2):
+            request = HttpRequest()
+            request.method = 'GET'
+            request.META['REMOTE_ADDR'] = '127.0.0.1'
+            responses.append(resource(request, emitter_format='json'))
+
+        self.assertEquals([200, 503], [ r.status_code for r in responses ])
+        self.assertEquals('1', responses[0]['X-RateLimit-Limit'])
+        self.assertEquals('0', responses[0]['X-RateLimit-Remaining'])
+        self.assertTrue(int(responses[1]['Retry-After']) > 0)
+
+    def test_resource_throttle_runs_first(self):
+        calls = [ ]
+
+        class MyHandler(BaseHandler):
+            allowed_methods = ('POST',)
+
+            def create(self, request):
+                calls.append(request.data)
+                return rc.CREATED
+
+        resource = Resource(MyHandler, throttle=(1, 60), pre_throttle=(1, 60))
+        responses = [ ]
+
+        for i in range(2):
+            request = HttpRequest()
+            request.method = 'POST'
+            request.META['REMOTE_ADDR'] = '10.0.0.39'
+            request.META['CONTENT_TYPE'] = 'application/json'
+            request._raw_post_data = '{"n": %d}' % i
+            responses.append(resource(request, emitter_format='json'))
+
+        self.assertEquals([201, 503], [ r.status_code for r in responses ])
+        self.assertEquals([{'n': 0}], calls)
+        self.assertFalse(hasattr(request, 'data'))
+
+    def test_resource_pre_throttle_is_larger(self):
+        resource = Resource(BaseHandler, throttle=(5, 60))
+        self.assertEquals(5, resource.throttle.max_requests)
+        self.assertEquals(50, resource.pre_throttle.max_requests)
+
+class PartialUpdateTest(TestCase):
+    def test_patch_calls_partial_update(self):
+        class MyHandler(BaseHandler):
+            allowed_methods = ('PATCH',)
+
+            def partial_update(self, request):
+                return request.data.dict()
+
+        request = HttpRequest()
+        request.method = 'PATCH'
+        request.META['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        request._raw_post_data = 'msg=hello&oauth_nonce=abc'
+        response = Resource(MyHandler)(request, emitter_format='json')
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals({'msg': 'hello'}, simplejson.loads(response.content))
+
+    def test_body_is_parsed_lazily(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'msg': 'hello'}
+
+        data = LazyQueryDict(loader)
+        self.assertEquals([], calls)
+
+        self.assertEquals('hello', data['msg'])
+        self.assertEquals(['hello'], data.getlist('msg'))
+        self.assertEquals([1], calls)
+
+    def test_cleanup_keeps_body_lazy(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return QueryDict('msg=hello&oauth_nonce=abc')
+
+        request = HttpRequest()
+        request.PUT = LazyQueryDict(loader)
+        Resource.cleanup_request(request)
+        self.assertEquals([], calls)
+
+        self.assertEquals(['msg'], request.PUT.keys())
+        request.PUT['msg'] = 'changed'
+        self.assertEquals('changed', request.PUT['msg'])
+        self.assertFalse('oauth_nonce' in request.PUT)
+        self.assertEquals([1], calls)
+
+    def test_view_over_plain_dict(self):
+        view = FilteredQueryDict({'msg': 'hello', 'oauth_nonce': 'abc'})
+        copied = view.copy()
+        self.assertTrue(isinstance(copied, QueryDict))
+        self.assertEquals([('msg', 'hello')], copied.items())
+
+        view.appendlist('msg', 'again')
+        self.assertEquals(['hello', 'again'], view.getlist('msg'))
+
+
+class TimingTest(TestCase):
+    def test_nested_phases_are_exclusive(self):
+        timer = PhaseTimer()
+
+        with timer.phase('render'):
+            with timer.phase('construct'):
+                pass
+            with timer.phase('construct'):
+                pass
+
+        self.assertEquals(['render', 'construct'], [ name for name, _ in timer.timings ])
+        self.assertTrue(all([ seconds >= 0 for _, seconds in timer.timings ]))
+        self.assertTrue(timer.header().startswith('render;dur='))
+
+    def test_server_timing_header(self):
+        class MyHandler(BaseHandler):
+            allowed_methods = ('GET',)
+
+            def read(self, request):
+                return {'msg': 'hello'}
+
+        resource = Resource(MyHandler)
+        resource.timing = resource.server_timing = True
+        aggregator.reset()
+
+        request = HttpRequest()
+        request.method = 'GET'
+        response = resource(request, emitter_format='json')
+
+        phases = [ p.split(';')[0] for p in response['Server-Timing'].split(', ') ]
+        self.assertEquals(['auth', 'handler', 'construct', 'render'], phases)
+        self.assertEquals(1, aggregator.snapshot()[('MyHandler', 'handler')][0])
@@ -0,0 +1,373 @@
+from __future__ import with_statement
+
+import math
+import time
+import weakref
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache, get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import importlib
+from django.utils.encoding import smart_str
+
+class RateLimit(object):
+    """
+    The outcome of counting a request against a throttle:
+    whether it's `allowed`, the `limit`, the number of requests
+    `remaining` and the seconds until the limit `reset`s.
+    """
+    def __init__(self, allowed, limit, remaining, reset):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def add_headers(self, response):
+        response['X-RateLimit-Limit'] = str(self.limit)
+        response['X-RateLimit-Remaining'] = str(self.remaining)
+        response['X-RateLimit-Reset'] = str(self.reset)
+
+        if not self.allowed:
+            response['Retry-After'] = str(self.reset)
+
+class Throttle(object):
+    """
+    Base class for throttle engines, allowing `max_requests`
+    per `timeout` seconds for each identity passed to `hit`.
+
+    Engines only keep integer counters in the cache and change
+    them with `incr`/`decr`, so they're atomic on backends with
+    atomic increments, like memcached. Any Django cache backend
+    can be passed as `cache`; the default cache is used if not.
+    """
+    prefix = 'piston-throttle'
+
+    def __init__(self, max_requests, timeout, cache=None):
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.cache = cache or default_cache()
+
+    def key(self, ident, window):
+        return '%s:%s:%s:%d' % (self.prefix, self.__class__.__name__.lower(),
+                                hashlib.md5(smart_str(ident)).hexdigest(), window)
+
+    def incr(self, key, delta, timeout):
+        """
+        Adds `delta` to the counter at `key`, creating it with
+        the given `timeout` if it doesn't exist yet.
+        """
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            if self.cache.add(key, delta, timeout):
+                return delta
+            return self.cache.incr(key, delta)
+
+    def decr(self, key, delta=1):
+        try:
+            self.cache.decr(key, delta)
+        except ValueError:
+            pass
+
+    def hit(self, ident, now=None):
+        """
+        Counts a request by `ident` and returns a `RateLimit`.
+        """
+        raise NotImplementedError
+
+class FixedWindow(Throttle):
+    """
+    Counts requests in consecutive windows of `timeout`
+    seconds. Costs one cache round-trip per request, but
+    allows bursts of twice the limit around window edges.
+    """
+    def hit(self, ident, now=None):
+        if now is None:
+            now = time.time()
+
+        start = int(now // self.timeout) * self.timeout
+        reset = int(math.ceil(start + self.timeout - now))
+
+        count = self.incr(self.key(ident, start), 1, self.timeout)
+
+        return RateLimit(count <= self.max_requests, self.max_requests,
+                         max(self.max_requests - count, 0), reset)
+
+class SlidingWindow(Throttle):
+    """
+    Estimates the requests made in the last `timeout` seconds
+    from the counts of the current and the previous window,
+    weighing the latter by how much of it is still in range.
+    Smooths out the edges of `FixedWindow` at the cost of an
+    extra cache read. Refused requests aren't counted.
+    """
+    def hit(self, ident, now=None):
+        if now is None:
+            now = time.time()
+
+        start = int(now // self.timeout) * self.timeout
+        current = self.key(ident, start)
+
+        count = self.incr(current, 1, 2 * self.timeout)
+        previous = self.cache.get(self.key(ident, start - self.timeout), 0)
+
+        weight = 1 - (now - start) / float(self.timeout)
+        used = count + int(previous * weight)
+        reset = int(math.ceil(start + self.timeout - now))
+
+        if used > self.max_requests:
+            self.decr(current)
+            return RateLimit(False, self.max_requests, 0, reset)
+
+        return RateLimit(True, self.max_requests, self.max_requests - used, reset)
+
+class TokenBucket(Throttle):
+    """
+    A bucket of `max_requests` tokens, refilled at a steady
+    `max_requests / timeout` tokens per second. Allows bursts
+    up to the size of the bucket, and then a steady rate.
+
+    Instead of storing the tokens left, which can't be done
+    atomically, the engine counts the tokens taken since the
+    start of a long `period`, and compares that to the tokens
+    earned since. Tokens which would overflow the bucket are
+    taken away, and refused requests hand theirs back.
+    """
+    periods = 100
+
+    def __init__(self, *args, **kwargs):
+        super(TokenBucket, self).__init__(*args, **kwargs)
+        self.interval = self.timeout / float(self.max_requests)
+        self.period = self.timeout * self.periods
+
+    def hit(self, ident, now=None):
+        if now is None:
+            now = time.time()
+
+        start = int(now // self.period) * self.period
+        key = self.key(ident, start)
+
+        taken = self.incr(key, 1, int(start + self.period - now) + 1)
+        left = self.max_requests + (now - start) / self.interval - taken
+
+        if left < 0:
+            self.decr(key)
+            return RateLimit(False, self.max_requests, 0,
+                             int(math.ceil(-left * self.interval)))
+
+        overflow = int(left - self.max_requests + 1)
+
+        if overflow > 0:
+            # Idle for a while, so the bucket overflowed.
+            self.incr(key, overflow, int(start + self.period - now) + 1)
+            left -= overflow
+
+        remaining = int(left)
+
+        return RateLimit(True, self.max_requests, remaining,
+                         int(math.ceil((self.max_requests - remaining) * self.interval)))
+
+class ApproximateWindow(FixedWindow):
+    """
+    A `FixedWindow` which counts hits in-process, and only
+    adds them to the shared counter in the cache in batches,
+    so most requests don't cost a cache round-trip at all.
+
+    Each worker may admit up to `tolerance` times the limit
+    before it syncs, or `flush_interval` seconds of hits,
+    whichever comes first. Close to the limit every hit is
+    synced, and once the limit is known to be reached, hits
+    are refused locally until the window ends. The limit can
+    be overshot by up to one batch per worker.
+
+    A daemon thread also flushes every `flush_interval`
+    seconds, so the hits of a worker which went idle still
+    reach the shared counter. It stops once the engine is
+    garbage collected.
+    """
+    def __init__(self, max_requests, timeout, cache=None, tolerance=None, flush_interval=None):
+        super(ApproximateWindow, self).__init__(max_requests, timeout, cache)
+
+        if tolerance is None:
+            tolerance = getattr(settings, 'PISTON_THROTTLE_TOLERANCE', 0.1)
+
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'PISTON_THROTTLE_FLUSH_INTERVAL', 1.0)
+
+        self.batch = max(1, int(max_requests * tolerance))
+        self.flush_interval = flush_interval
+        self.counters = { }
+        self.window = None
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def start(self):
+        """
+        Starts the thread flushing every `flush_interval` seconds.
+        """
+        if self._flusher is not None or not self.flush_interval:
+            return
+
+        with self._lock:
+            if self._flusher is None:
+                flusher = threading.Thread(target=flush_periodically, name='piston-throttle-flusher',
+                                           args=(weakref.ref(self), self.flush_interval))
+                flusher.setDaemon(True)
+                flusher.start()
+                self._flusher = flusher
+
+    def flush(self, now=None):
+        """
+        Adds the hits counted locally to the shared counters.
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            pending = [ (key, counter, counter[1])
+                        for key, counter in self.counters.iteritems() if counter[1] ]
+
+            for key, counter, count in pending:
+                counter[1:] = [ 0, now ]
+
+        for key, counter, count in pending:
+            shared = self.incr(key, count, self.timeout)
+
+            with self._lock:
+                counter[0] = max(counter[0], shared)
+
+    def hit(self, ident, now=None):
+        if now is None:
+            now = time.time()
+
+        self.start()
+
+        start = int(now // self.timeout) * self.timeout
+        reset = int(math.ceil(start + self.timeout - now))
+        key = self.key(ident, start)
+
+        with self._lock:
+            if start != self.window:
+                self.window = start
+                self.counters = { }
+
+            # [ shared count last seen, local hits since, last sync ]
+            counter = self.counters.setdefault(key, [ 0, 0, None ])
+            shared, pending, synced = counter
+
+            if shared >= self.max_requests:
+                return RateLimit(False, self.max_requests, 0, reset)
+
+            pending += 1
+            flush = (pending >= self.batch
+                     or synced is None or now - synced >= self.flush_interval
+                     or shared + pending + self.batch > self.max_requests)
+
+            if flush:
+                counter[1:] = [ 0, now ]
+            else:
+                counter[1] = pending
+
+        if flush:
+            shared = self.incr(key, pending, self.timeout)
+
+            with self._lock:
+                counter[0] = max(counter[0], shared)
+                pending = counter[1]
+
+        used = shared + pending
+
+        return RateLimit(used <= self.max_requests, self.max_requests,
+                         max(self.max_requests - used, 0), reset)
+
+def flush_periodically(ref, interval):
+    """
+    Flushes the `ApproximateWindow` behind the weak reference
+    `ref` every `interval` seconds, for as long as it's alive.
+    """
+    while True:
+        time.sleep(interval)
+
+        engine = ref()
+        if engine is None:
+            return
+
+        engine.flush()
+        del engine
+
+ENGINES = {
+    'fixed': FixedWindow,
+    'sliding': SlidingWindow,
+    'bucket': TokenBucket,
+    'approximate': ApproximateWindow,
+}
+
+def default_cache():
+    """
+    Returns the cache named by `PISTON_THROTTLE_CACHE`, or the
+    default cache if that isn't set.
+    """
+    backend = getattr(settings, 'PISTON_THROTTLE_CACHE', None)
+
+    if backend:
+        return get_cache(backend)
+
+    return cache
+
+def get_engine(path=None):
+    """
+    Loads a throttle engine by name (`fixed`, `sliding` or
+    `bucket`) or dotted path, defaulting to the one set in
+    `PISTON_THROTTLE_ENGINE`. Classes are passed through.
+    """
+    if path is None:
+        path = getattr(settings, 'PISTON_THROTTLE_ENGINE', 'fixed')
+
+    if not isinstance(path, basestring):
+        return path
+
+    if path in ENGINES:
+        return ENGINES[path]
+
+    try:
+        module, attr = path.rsplit('.', 1)
+        return getattr(importlib.import_module(module), attr)
+    except ValueError:
+        raise ImproperlyConfigured('Invalid piston throttle engine string: "%s"' % path)
+    except ImportError, e:
+        raise ImproperlyConfigured('Error loading piston throttle engine module "%s": "%s"' % (module, e))
+    except AttributeError:
+        raise ImproperlyConfigured('Module "%s" does not define a piston throttle engine named "%s"' % (module, attr))
+
+def identify_unverified(request):
+    """
+    Returns who `request` comes from before it's authenticated:
+    the client's IP address alone. Anything else the client
+    sends, like an OAuth consumer key, is unverified, and would
+    let a flood buy a fresh budget by changing it every time.
+    """
+    return request.META.get('REMOTE_ADDR', None) or None
+
+def identify(request, extra=''):
+    """
+    Returns who `request` should be throttled as: the user
+    if logged in, the client's IP address otherwise. OAuth
+    sets `throttle_extra` to the consumer key, which makes
+    the limit apply per consumer. `extra` is appended last.
+    """
+    user = getattr(request, 'user', None)
+
+    if user is not None and user.is_authenticated():
+        ident = user.username
+    else:
+        ident = request.META.get('REMOTE_ADDR', None)
+
+    if not ident:
+        return None
+
+    if hasattr(request, 'throttle_extra'):
+        ident += ':%s' % str(request.throttle_extra)
+
+    return '%s:%s' % (ident, extra)
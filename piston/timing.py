@@ -0,0 +1,146 @@
+from __future__ import with_statement
+
+import time
+import threading
+
+from signals import request_timed
+
+class NullTimer(object):
+    """
+    Stand-in for `PhaseTimer` when timing is disabled, so
+    instrumented code costs no more than a method call.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def wrap(self, name, func):
+        return func
+
+    def tag(self, handler):
+        pass
+
+    def finish(self, request, response, server_timing=False):
+        return response
+
+null_timer = NullTimer()
+
+class PhaseTimer(object):
+    """
+    Collects the wall-clock time spent in named phases of a
+    request. Phases may nest, in which case the time spent in
+    the inner phase is only counted there, so all phases add
+    up to the total time spent.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.timings = [ ]
+        self.handler = None
+        self._index = { }
+        self._stack = [ ]
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def add(self, name, seconds):
+        if name in self._index:
+            self.timings[self._index[name]][1] += seconds
+        else:
+            self._index[name] = len(self.timings)
+            self.timings.append([ name, seconds ])
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def tag(self, handler):
+        self.handler = handler
+
+    def header(self):
+        """
+        Formats the timings as a `Server-Timing` header value.
+        """
+        return ', '.join([ '%s;dur=%.2f' % (name, seconds * 1000)
+                           for name, seconds in self.timings ])
+
+    def finish(self, request, response, server_timing=False):
+        """
+        Sends `request_timed` and, if asked to, adds the
+        `Server-Timing` header to `response`.
+        """
+        if self.handler is not None:
+            sender = self.handler.__class__
+        else:
+            sender = None
+
+        request_timed.send(sender=sender, request=request,
+                           handler=self.handler, timings=self.timings)
+
+        if server_timing:
+            response['Server-Timing'] = self.header()
+
+        return response
+
+class Phase(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.timer._stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        stack = self.timer._stack
+        stack.pop()
+
+        if stack:
+            stack[-1].nested += elapsed
+
+        self.timer.add(self.name, elapsed - self.nested)
+        return False
+
+class StatsAggregator(object):
+    """
+    In-process sink for `request_timed`, keeping the count,
+    total and maximum seconds per handler and phase. Use
+    `snapshot` to read them, e.g. from a stats view.
+    """
+    def __init__(self):
+        self.stats = { }
+        self._lock = threading.Lock()
+
+    def receive(self, sender, handler=None, timings=(), **kwargs):
+        if handler is not None:
+            name = handler.__class__.__name__
+        else:
+            name = None
+
+        with self._lock:
+            for phase, seconds in timings:
+                count, total, peak = self.stats.get((name, phase), (0, 0.0, 0.0))
+                self.stats[(name, phase)] = (count + 1, total + seconds, max(peak, seconds))
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+aggregator = StatsAggregator()
+request_timed.connect(aggregator.receive, dispatch_uid='piston.timing.aggregator')
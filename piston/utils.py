@@ -1,18 +1,34 @@
 import time
 import warnings
+import threading
 from django.http import HttpResponseNotAllowed, HttpResponseForbidden, HttpResponse, HttpResponseBadRequest
+from django.http import QueryDict
 from django.core.urlresolvers import reverse
-from django.core.cache import cache
 from django import get_version as django_version
 from django.core.mail import send_mail, mail_admins
 from django.conf import settings
 from django.utils.translation import ugettext as _
 from django.template import loader, TemplateDoesNotExist
 from django.contrib.sites.models import Site
+from django.utils import simplejson
+from django.utils.datastructures import MergeDict, MultiValueDict, MultiValueDictKeyError
 from decorator import decorator
+from throttling import get_engine, identify
 
 from datetime import datetime, timedelta
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+# Fallback since `OrderedDict` isn't in Python <2.7. Eviction
+# order is arbitrary there, but the cache stays bounded.
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = dict
+
 __version__ = '0.3dev'
 
 def get_version():
@@ -22,6 +38,29 @@ def format_error(error):
     return u"Piston/%s (Django %s) crash report:\n\n%s" % \
         (get_version(), django_version(), error)
 
+class HttpResponseWrapper(HttpResponse):
+    """
+    Wrap HttpResponse and make sure that the internal _is_string
+    flag is updated when the _set_content method (via the content
+    property) is called
+    """
+    def _set_content(self, content):
+        """
+        Set the _container and _is_string properties based on the
+        type of the value parameter. This logic is in the construtor
+        for HttpResponse, but doesn't get repeated when setting
+        HttpResponse.content although this bug report (feature request)
+        suggests that it should: http://code.djangoproject.com/ticket/9403
+        """
+        if not isinstance(content, basestring) and hasattr(content, '__iter__'):
+            self._container = content
+            self._is_string = False
+        else:
+            self._container = [content]
+            self._is_string = True
+
+    content = property(HttpResponse._get_content, _set_content)
+
 class rc_factory(object):
     """
     Status codes.
@@ -36,10 +75,13 @@ class rc_factory(object):
                  NOT_FOUND = ('Not Found', 404),
                  DUPLICATE_ENTRY = ('Conflict/Duplicate', 409),
                  NOT_HERE = ('Gone', 410),
+                 REQUEST_ENTITY_TOO_LARGE = ('Request Entity Too Large', 413),
                  INTERNAL_ERROR = ('Internal Error', 500),
                  NOT_IMPLEMENTED = ('Not Implemented', 501),
                  THROTTLED = ('Throttled', 503))
 
+    forbidden_warned = False
+
     def __getattr__(self, attr):
         """
         Returns a fresh `HttpResponse` when getting
@@ -47,41 +89,235 @@ class rc_factory(object):
         with 0.2, which is important.
         """
         try:
-            (r, c) = self.CODES.get(attr)
-        except TypeError:
+            (r, c) = self.CODES[attr]
+        except KeyError:
             raise AttributeError(attr)
 
-        if (r, c) == ('Forbidden', 401):
+        if attr == 'FORBIDDEN' and not rc_factory.forbidden_warned:
+            rc_factory.forbidden_warned = True
             warnings.warn('In future versions rc.FORBIDDEN will return 403 and rc.UNAUTHORIZED 401.', PendingDeprecationWarning)
             warnings.warn('Please change all your rc.FORBIDDEN for rc.UNAUTHORIZED', DeprecationWarning)
 
-        class HttpResponseWrapper(HttpResponse):
-            """
-            Wrap HttpResponse and make sure that the internal _is_string
-            flag is updated when the _set_content method (via the content
-            property) is called
-            """
-            def _set_content(self, content):
-                """
-                Set the _container and _is_string properties based on the
-                type of the value parameter. This logic is in the construtor
-                for HttpResponse, but doesn't get repeated when setting
-                HttpResponse.content although this bug report (feature request)
-                suggests that it should: http://code.djangoproject.com/ticket/9403
-                """
-                if not isinstance(content, basestring) and hasattr(content, '__iter__'):
-                    self._container = content
-                    self._is_string = False
-                else:
-                    self._container = [content]
-                    self._is_string = True
-
-            content = property(HttpResponse._get_content, _set_content)
-
         return HttpResponseWrapper(r, content_type='text/plain', status=c)
 
 rc = rc_factory()
 
+class LRUCache(object):
+    """
+    Small, thread-safe mapping holding at most `maxsize`
+    entries. When full, the least recently used entry
+    is evicted to make room for a new one.
+
+    With a `ttl`, entries also expire that many seconds
+    after they were set. `set` can override it per entry.
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self._data[key] = (value, expires)
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+
+        if ttl is not None:
+            expires = time.time() + ttl
+        else:
+            expires = None
+
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            while self._data and len(self._data) >= self.maxsize:
+                del self._data[iter(self._data).next()]
+            self._data[key] = (value, expires)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
+
+_missing = object()
+
+class QueryDictView(MergeDict):
+    """
+    View offering the `QueryDict` API over `self.data`, which
+    may be a `QueryDict` or a plain dict. Subclasses can hide
+    keys via `_visible` or provide `data` lazily. `copy` returns
+    a real, mutable `QueryDict` just like `QueryDict.copy`, and
+    the first write replaces `data` with such a copy, so that
+    handlers can still change e.g. `request.PUT`.
+
+    Subclasses `MergeDict` so form widgets still call `getlist`.
+    """
+    def __init__(self, data):
+        self._data = data
+
+    data = property(lambda self: self._data)
+    dicts = property(lambda self: (self.data,))
+
+    def _visible(self, key):
+        return True
+
+    @property
+    def encoding(self):
+        return getattr(self.data, 'encoding', settings.DEFAULT_CHARSET)
+
+    def __getitem__(self, key):
+        if not self._visible(key):
+            raise MultiValueDictKeyError("Key %r not found in %r" % (key, self))
+        return self.data[key]
+
+    def get(self, key, default=None):
+        if not self._visible(key):
+            return default
+        return self.data.get(key, default)
+
+    def getlist(self, key):
+        if not self._visible(key):
+            return []
+        if hasattr(self.data, 'getlist'):
+            return self.data.getlist(key)
+        if key in self.data:
+            return [ self.data[key] ]
+        return []
+
+    def has_key(self, key):
+        return self._visible(key) and key in self.data
+    __contains__ = has_key
+
+    def iterkeys(self):
+        return (k for k in self.data.iterkeys() if self._visible(k))
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        return ((k, self.data[k]) for k in self.iterkeys())
+
+    def itervalues(self):
+        return (self.data[k] for k in self.iterkeys())
+
+    def iterlists(self):
+        return ((k, self.getlist(k)) for k in self.iterkeys())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def lists(self):
+        return list(self.iterlists())
+
+    def dict(self):
+        return dict(self.iteritems())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _mutable(self):
+        if not getattr(self, '_copied', False):
+            self._data = self.copy()
+            self._copied = True
+        return self._data
+
+    def __setitem__(self, key, value):
+        self._mutable()[key] = value
+
+    def __delitem__(self, key):
+        del self._mutable()[key]
+
+    def setlist(self, key, values):
+        self._mutable().setlist(key, values)
+
+    def appendlist(self, key, value):
+        self._mutable().appendlist(key, value)
+
+    def setdefault(self, key, default=None):
+        return self._mutable().setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self._mutable().pop(key, *default)
+
+    def update(self, other):
+        self._mutable().update(other)
+
+    def copy(self):
+        sanitized = QueryDict('', mutable=True, encoding=self.encoding)
+
+        for k in self.iterkeys():
+            sanitized.setlist(k, list(self.getlist(k)))
+
+        return sanitized
+    __copy__ = copy
+
+    def urlencode(self, *args, **kwargs):
+        return self.copy().urlencode(*args, **kwargs)
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self.dict())
+
+class FilteredQueryDict(QueryDictView):
+    """
+    View over a `QueryDict` which hides every key starting
+    with `prefix`. Nothing is copied unless `copy` is called.
+    """
+    def __init__(self, data, prefix='oauth_'):
+        QueryDictView.__init__(self, data)
+        self.prefix = prefix
+
+    def _visible(self, key):
+        return not (isinstance(key, basestring) and key.startswith(self.prefix))
+
+class LazyQueryDict(QueryDictView):
+    """
+    View whose underlying dict is only built, by calling
+    `loader`, the first time it is actually looked at.
+    """
+    def __init__(self, loader):
+        QueryDictView.__init__(self, None)
+        self._loader = loader
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
 class FormValidationError(Exception):
     def __init__(self, form):
         self.form = form
@@ -102,9 +338,9 @@ def validate(v_form, operation='POST'):
             raise FormValidationError(form)
     return wrap
 
-def throttle(max_requests, timeout=60*60, extra=''):
+def throttle(max_requests, timeout=60*60, extra='', engine=None):
     """
-    Simple throttling decorator, caches
+    Simple throttling decorator, counts
     the amount of requests made in cache.
 
     If used on a view where users are required to
@@ -114,85 +350,98 @@ def throttle(max_requests, timeout=60*60, extra=''):
     Parameters::
      - `max_requests`: The maximum number of requests
      - `timeout`: The timeout for the cache entry (default: 1 hour)
+     - `extra`: Appended to the identity, to throttle per action
+     - `engine`: The throttle engine, see `piston.throttling`
+       (default: `PISTON_THROTTLE_ENGINE`, or a fixed window)
+
+    The outcome is kept as `request.rate_limit`, which
+    `Resource` turns into `X-RateLimit-*` headers.
     """
+    engines = [ ]
+
     @decorator
     def wrap(f, self, request, *args, **kwargs):
-        if request.user.is_authenticated():
-            ident = request.user.username
-        else:
-            ident = request.META.get('REMOTE_ADDR', None)
-
-        if hasattr(request, 'throttle_extra'):
-            """
-            Since we want to be able to throttle on a per-
-            application basis, it's important that we realize
-            that `throttle_extra` might be set on the request
-            object. If so, append the identifier name with it.
-            """
-            ident += ':%s' % str(request.throttle_extra)
+        ident = identify(request, extra)
 
         if ident:
-            """
-            Preferrably we'd use incr/decr here, since they're
-            atomic in memcached, but it's in django-trunk so we
-            can't use it yet. If someone sees this after it's in
-            stable, you can change it here.
-            """
-            ident += ':%s' % extra
+            if not engines:
+                engines.append(get_engine(engine)(max_requests, timeout))
 
-            now = time.time()
-            count, expiration = cache.get(ident, (1, None))
+            limit = engines[0].hit(ident)
+            request.rate_limit = limit
 
-            if expiration is None:
-                expiration = now + timeout
-
-            if count >= max_requests and expiration > now:
-                t = rc.THROTTLED
-                wait = int(expiration - now)
-                t.content = 'Throttled, wait %d seconds.' % wait
-                t['Retry-After'] = wait
-                return t
-
-            cache.set(ident, (count+1, expiration), (expiration - now))
+            if not limit.allowed:
+                return throttled(limit)
 
         return f(self, request, *args, **kwargs)
     return wrap
 
+def throttled(limit):
+    """
+    The response for a request refused by a throttle.
+    """
+    t = rc.THROTTLED
+    t.content = 'Throttled, wait %d seconds.' % limit.reset
+    limit.add_headers(t)
+    return t
+
+def load_body(request):
+    """
+    Parses a form-encoded or multipart request body into a
+    `(QueryDict, MultiValueDict)` pair, regardless of the
+    request method. Django only does this for POST.
+
+    If something (like middleware) already read the body via
+    `raw_post_data`, the cached copy is used instead of the
+    input stream, so the body is never read twice.
+    """
+    encoding = getattr(request, 'encoding', None) or settings.DEFAULT_CHARSET
+
+    if getattr(request, '_read_started', False) and not hasattr(request, '_raw_post_data'):
+        # The stream was consumed elsewhere, nothing left to parse.
+        return QueryDict('', encoding=encoding), MultiValueDict()
+
+    if request.META.get('CONTENT_TYPE', '').startswith('multipart'):
+        if hasattr(request, '_raw_post_data'):
+            data = StringIO(request._raw_post_data)
+        else:
+            data = request
+
+        return request.parse_file_upload(request.META, data)
+
+    return QueryDict(request.raw_post_data, encoding=encoding), MultiValueDict()
+
 def coerce_put_post(request):
     """
     Django doesn't particularly understand REST.
-    In case we send data over PUT, Django won't
-    actually look at the data and load it. We need
-    to twist its arm here.
-
-    The try/except abominiation here is due to a bug
-    in mod_python. This should fix it.
-    """
-    if request.method == "PUT":
-        # Bug fix: if _load_post_and_files has already been called, for
-        # example by middleware accessing request.POST, the below code to
-        # pretend the request is a POST instead of a PUT will be too late
-        # to make a difference. Also calling _load_post_and_files will result
-        # in the following exception:
-        #   AttributeError: You cannot set the upload handlers after the upload has been processed.
-        # The fix is to check for the presence of the _post field which is set
-        # the first time _load_post_and_files is called (both by wsgi.py and
-        # modpython.py). If it's set, the request has to be 'reset' to redo
-        # the query value parsing in POST mode.
-        if hasattr(request, '_post'):
-            del request._post
-            del request._files
+    In case we send data over PUT (or PATCH), Django
+    won't actually look at the data and load it.
+
+    Rather than twisting its arm by pretending to be a
+    POST, we hand out lazy dicts for `request.PUT`,
+    `request.POST` and `request.FILES`. The body is only
+    parsed (once) when the handler looks at one of them.
+    """
+    if request.method in ("PUT", "PATCH"):
+        body = [ ]
+
+        def load():
+            if not body:
+                body.append(load_body(request))
+            return body[0]
+
+        data = LazyQueryDict(lambda: load()[0])
+        files = LazyQueryDict(lambda: load()[1])
+
+        request.PUT = request.POST = data
+        setattr(request, request.method, data)
 
         try:
-            request.method = "POST"
-            request._load_post_and_files()
-            request.method = "PUT"
+            request.FILES = files
         except AttributeError:
-            request.META['REQUEST_METHOD'] = 'POST'
-            request._load_post_and_files()
-            request.META['REQUEST_METHOD'] = 'PUT'
-
-        request.PUT = request.POST
+            # `FILES` is a read-only property on Django's
+            # handler requests, backed by `_files`.
+            request._files = files
 
 
 class MimerDataException(Exception):
@@ -201,8 +450,148 @@ class MimerDataException(Exception):
     """
     pass
 
+class MimerDataTooLarge(MimerDataException):
+    """
+    Raised if the body is larger than `PISTON_MAX_BODY_SIZE`
+    """
+    pass
+
+class LimitedReader(object):
+    """
+    File-like wrapper raising `MimerDataTooLarge` as soon as
+    more than `limit` bytes have been read from `stream`.
+    """
+    def __init__(self, stream, limit=None):
+        self.stream = stream
+        self.limit = limit
+        self.consumed = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.stream.read()
+        else:
+            data = self.stream.read(size)
+
+        self.consumed += len(data)
+
+        if self.limit is not None and self.consumed > self.limit:
+            raise MimerDataTooLarge
+
+        return data
+
+class JSONStreamLoader(object):
+    """
+    Decodes JSON read from a file-like object in chunks. Top-level
+    arrays (batch uploads) are decoded one element at a time, so
+    besides the decoded result only the current chunk and element
+    are buffered. Other documents are read and decoded as a whole.
+    """
+    WHITESPACE = ' \t\n\r'
+    NUMBER_CHARS = '0123456789+-.eE'
+
+    def __init__(self, stream, chunk_size=64*1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = simplejson.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """
+        Reads another chunk into the buffer, dropping what has
+        already been decoded. Returns False at end of stream.
+        """
+        if self.eof:
+            return False
+
+        if self.pos >= self.chunk_size:
+            self.buf, self.pos = self.buf[self.pos:], 0
+
+        chunk = self.stream.read(size or self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf += chunk
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character,
+        or an empty string at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill():
+                return ''
+
+    def element(self):
+        """
+        Decodes the value at the current position. A number at the
+        end of the buffer may be truncated (`1.5` of `1.5e3`), so a
+        value is only trusted once a delimiter follows it.
+        """
+        if not self.peek():
+            raise ValueError("Expecting JSON value")
+
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                obj, end = None, None
+
+            if end is not None and (self.eof or (end < len(self.buf)
+                    and self.buf[end] not in self.NUMBER_CHARS)):
+                self.pos = end
+                return obj
+
+            # Grow reads along with the element, keeping re-parses linear.
+            if not self.fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                if end is None:
+                    raise ValueError("Unterminated JSON value")
+
+    def load(self):
+        if self.peek() != '[':
+            rest = [ self.buf[self.pos:] ]
+            rest.extend(iter(lambda: self.stream.read(self.chunk_size), ''))
+            return simplejson.loads(''.join(rest))
+
+        self.pos += 1
+        items = [ ]
+
+        if self.peek() == ']':
+            self.pos += 1
+        else:
+            while True:
+                items.append(self.element())
+
+                c = self.peek()
+                self.pos += 1
+
+                if c == ']':
+                    break
+                elif c != ',':
+                    raise ValueError("Expecting , delimiter")
+
+        if self.peek():
+            raise ValueError("Extra data after JSON array")
+
+        return items
+
+def load_json_stream(stream):
+    return JSONStreamLoader(stream).load()
+
 class Mimer(object):
     TYPES = dict()
+    INDEX = dict()
+    STREAMING = set()
 
     def __init__(self, request):
         self.request = request
@@ -218,12 +607,20 @@ class Mimer(object):
     def loader_for_type(self, ctype):
         """
         Gets a function ref to deserialize content
-        for a certain mimetype.
+        for a certain mimetype. Exact matches are a
+        single lookup in `INDEX`, anything else falls
+        back to prefix matching.
         """
-        for loadee, mimes in Mimer.TYPES.iteritems():
-            for mime in mimes:
-                if ctype.startswith(mime):
-                    return loadee
+        ctype = ctype.strip().lower()
+
+        try:
+            return Mimer.INDEX[ctype]
+        except KeyError:
+            pass
+
+        for mime, loadee in Mimer.INDEX.iteritems():
+            if ctype.startswith(mime):
+                return loadee
 
     def content_type(self):
         """
@@ -242,6 +639,40 @@ class Mimer(object):
 
         return ctype
 
+    def body(self, stream=False):
+        """
+        Returns the request body, or a file-like object to read it
+        from if `stream` is set. Either way, `PISTON_MAX_BODY_SIZE`
+        is enforced by raising `MimerDataTooLarge`.
+
+        The body is only streamed from the input if nothing read it
+        yet; `request.raw_post_data` is unavailable afterwards.
+        """
+        max_size = getattr(settings, 'PISTON_MAX_BODY_SIZE', None)
+
+        try:
+            length = int(self.request.META.get('CONTENT_LENGTH') or 0)
+        except (ValueError, TypeError):
+            length = 0
+
+        if max_size is not None and length > max_size:
+            raise MimerDataTooLarge
+
+        if not stream:
+            data = self.request.raw_post_data
+
+            if max_size is not None and len(data) > max_size:
+                raise MimerDataTooLarge
+
+            return data
+
+        if hasattr(self.request, '_raw_post_data'):
+            source = StringIO(self.request._raw_post_data)
+        else:
+            source = self.request
+
+        return LimitedReader(source, max_size)
+
     def translate(self):
         """
         Will look at the `Content-type` sent by the client, and maybe
@@ -263,11 +694,14 @@ class Mimer(object):
 
             if loadee:
                 try:
-                    self.request.data = loadee(self.request.raw_post_data)
+                    self.request.data = loadee(self.body(loadee in Mimer.STREAMING))
 
-                    # Reset both POST and PUT from request, as its
-                    # misleading having their presence around.
+                    # Reset both POST and PUT (and PATCH) from request,
+                    # as its misleading having their presence around.
                     self.request.POST = self.request.PUT = dict()
+
+                    if hasattr(self.request, 'PATCH'):
+                        self.request.PATCH = dict()
                 except (TypeError, ValueError):
                     # This also catches if loadee is None.
                     raise MimerDataException
@@ -277,13 +711,89 @@ class Mimer(object):
         return self.request
 
     @classmethod
-    def register(cls, loadee, types):
+    def register(cls, loadee, types, stream=False):
+        """
+        Register a deserializer for `types`. If `stream` is set,
+        `loadee` is handed a file-like object instead of a string.
+        """
         cls.TYPES[loadee] = types
 
+        for mime in types:
+            cls.INDEX[mime.lower()] = loadee
+
+        if stream:
+            cls.STREAMING.add(loadee)
+        else:
+            cls.STREAMING.discard(loadee)
+
     @classmethod
     def unregister(cls, loadee):
+        for mime, l in cls.INDEX.items():
+            if l is loadee:
+                del cls.INDEX[mime]
+
+        cls.STREAMING.discard(loadee)
+
         return cls.TYPES.pop(loadee)
 
+def parse_accept_header(accept):
+    """
+    Parses an `Accept` header into a list of media ranges,
+    most preferred first. Ranges with `q=0` are dropped, and
+    ties are broken by specificity and then by header order.
+
+    >>> parse_accept_header('text/*;q=0.5, application/json')
+    ['application/json', 'text/*']
+    """
+    ranges = [ ]
+
+    for idx, part in enumerate(accept.split(',')):
+        params = part.split(';')
+        mime = params[0].strip().lower()
+
+        if not mime:
+            continue
+
+        q = 1.0
+
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        if q <= 0:
+            continue
+
+        if mime == '*/*':
+            specificity = 0
+        elif mime.endswith('/*'):
+            specificity = 1
+        else:
+            specificity = 2
+
+        ranges.append((-q, -specificity, idx, mime))
+
+    ranges.sort()
+
+    return [ mime for _, _, _, mime in ranges ]
+
+def has_body(request):
+    """
+    Returns whether `request` came with a body, going by the
+    body itself if it was read already, or `CONTENT_LENGTH`.
+    """
+    if hasattr(request, '_raw_post_data'):
+        return bool(request._raw_post_data)
+
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0) > 0
+    except (ValueError, TypeError):
+        return False
+
 def translate_mime(request):
     request = Mimer(request).translate()
 
@@ -3,7 +3,7 @@ from django.core.paginator import Paginator
 from piston.handler import BaseHandler
 from piston.utils import rc, validate
 
-from models import TestModel, ExpressiveTestModel, Comment, InheritedModel, PlainOldObject, Issue58Model, ListFieldsModel
+from models import TestModel, ExpressiveTestModel, Comment, InheritedModel, PlainOldObject, Issue58Model, ListFieldsModel, BulkModel, BulkChildModel
 from forms import EchoForm
 from test_project.apps.testapp import signals
 
@@ -76,11 +76,27 @@ class EchoHandler(BaseHandler):
     def read(self, request):
         return {'msg': request.form.cleaned_data['msg']}
 
+class EchoUpdateHandler(BaseHandler):
+    allowed_methods = ('PUT',)
+
+    @validate(EchoForm, 'PUT')
+    def update(self, request):
+        return {'msg': request.form.cleaned_data['msg']}
+
 class ListFieldsHandler(BaseHandler):
     model = ListFieldsModel
     fields = ('id','kind','variety','color')
     list_fields = ('id','variety')
 
+class BulkHandler(BaseHandler):
+    model = BulkModel
+    fields = ('id', 'name')
+    bulk_batch_size = 2
+
+class BulkChildHandler(BaseHandler):
+    model = BulkChildModel
+    fields = ('name', 'size')
+
 class Issue58Handler(BaseHandler):
     model = Issue58Model
 
@@ -38,3 +38,9 @@ class ListFieldsModel(models.Model):
 class Issue58Model(models.Model):
     read = models.BooleanField(default=False)
     model = models.CharField(max_length=1, blank=True, null=True)
+
+class BulkModel(models.Model):
+    name = models.CharField(max_length=32, unique=True)
+
+class BulkChildModel(BulkModel):
+    size = models.IntegerField(default=0)
@@ -1,3 +1,6 @@
+from __future__ import with_statement
+
+import time
 import urlparse
 
 import oauth2 as oauth
@@ -6,8 +9,9 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils import simplejson
 from piston import utils
+from piston.test import OAuthClient, frozen_time
 
-from piston.models import Consumer
+from piston.models import Consumer, Nonce
 
 try:
     import yaml
@@ -17,7 +21,7 @@ except ImportError:
 
 import base64
 
-from test_project.apps.testapp.models import TestModel, ExpressiveTestModel, Comment, InheritedModel, Issue58Model, ListFieldsModel
+from test_project.apps.testapp.models import TestModel, ExpressiveTestModel, Comment, InheritedModel, Issue58Model, ListFieldsModel, BulkModel, BulkChildModel
 from test_project.apps.testapp import signals
 
 
@@ -52,6 +56,98 @@ class MimerTests(TestCase):
         self.request.META['CONTENT_TYPE'] = 'application/json; charset=UTF-8'
         self.assertEqual('application/json', self.mimer.content_type())
 
+    def test_loader_for_type(self):
+        loadee = utils.Mimer.INDEX['application/json']
+        self.assertTrue(self.mimer.loader_for_type('application/json') is loadee)
+        self.assertTrue(self.mimer.loader_for_type('Application/JSON') is loadee)
+        self.assertTrue(self.mimer.loader_for_type('application/jsonrequest') is loadee)
+        self.assertEqual(None, self.mimer.loader_for_type('image/png'))
+
+    def test_json_stream_loader(self):
+        from StringIO import StringIO
+
+        for doc in ('[]', ' [ 1 , 2.5e3, "a,]" ] ', '{"a": [1, 2]}',
+                    simplejson.dumps([ {'n': i, 's': 'x' * i} for i in range(100) ])):
+            for chunk_size in (1, 3, 64):
+                loader = utils.JSONStreamLoader(StringIO(doc), chunk_size)
+                self.assertEqual(simplejson.loads(doc), loader.load())
+
+        for doc in ('', '[1,', '[1 2]', '[1] x'):
+            loader = utils.JSONStreamLoader(StringIO(doc), 2)
+            self.assertRaises(ValueError, loader.load)
+
+    def test_json_stream_loader_limit(self):
+        from StringIO import StringIO
+
+        stream = utils.LimitedReader(StringIO('[1, 2, 3, 4, 5]'), 5)
+        loader = utils.JSONStreamLoader(stream, 2)
+        self.assertRaises(utils.MimerDataTooLarge, loader.load)
+
+
+class AcceptNegotiationTests(TestCase):
+    def test_parse_accept_header(self):
+        self.assertEqual(['application/json', 'text/xml', 'text/*', '*/*'],
+            utils.parse_accept_header('*/*;q=0.1, text/*;q=0.5, text/xml;q=0.5, application/json'))
+
+    def test_parse_accept_header_drops_unacceptable(self):
+        self.assertEqual(['text/xml'],
+            utils.parse_accept_header('application/json;q=0, text/xml'))
+
+    def test_negotiate(self):
+        from piston.emitters import Emitter
+
+        self.assertEqual('xml', Emitter.negotiate('text/xml'))
+        self.assertEqual('xml', Emitter.negotiate('application/json;q=0.2, text/xml'))
+        self.assertEqual('json', Emitter.negotiate('image/png'))
+        self.assertEqual('json', Emitter.negotiate('text/html,*/*;q=0.8'))
+        self.assertEqual('json', Emitter.negotiate(None))
+
+    def test_accept_header_selects_emitter(self):
+        resp = self.client.get('/api/popo', HTTP_ACCEPT='text/xml')
+        self.assertEquals(resp.status_code, 200)
+        self.assert_(resp['Content-Type'].startswith('text/xml'))
+
+    def test_format_overrides_accept_header(self):
+        resp = self.client.get('/api/popo', {'format': 'json'}, HTTP_ACCEPT='text/xml')
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals({'type': 'plain', 'field': 'a field'}, simplejson.loads(resp.content))
+
+
+class CleanupRequestTests(TestCase):
+    def setUp(self):
+        from django.http import QueryDict
+
+        self.request = HttpRequest()
+        self.request.GET = QueryDict('a=1&a=2&oauth_token=t&oauth_nonce=n&b=3')
+
+    def test_hides_oauth_keys(self):
+        from piston.resource import Resource
+
+        request = Resource.cleanup_request(self.request)
+
+        self.assertEqual(['a', 'b'], sorted(request.GET.keys()))
+        self.assertEqual(['1', '2'], request.GET.getlist('a'))
+        self.assertEqual('3', request.GET['b'])
+        self.assertEqual(None, request.GET.get('oauth_token'))
+        self.assertFalse('oauth_nonce' in request.GET)
+        self.assertRaises(KeyError, lambda: request.GET['oauth_token'])
+        self.assertEqual(2, len(request.GET))
+
+    def test_copy_is_mutable_and_sanitized(self):
+        from piston.resource import Resource
+
+        copy = Resource.cleanup_request(self.request).GET.copy()
+        copy['c'] = '4'
+
+        self.assertEqual(['a', 'b', 'c'], sorted(copy.keys()))
+
+    def test_untouched_without_oauth_keys(self):
+        from django.http import QueryDict
+        from piston.resource import Resource
+
+        get = self.request.GET = QueryDict('a=1')
+        self.assertTrue(Resource.cleanup_request(self.request).GET is get)
+
 
 class OAuthTests(MainTests):
     signature_method = oauth.SignatureMethod_HMAC_SHA1()
@@ -133,6 +229,60 @@ class OAuthTests(MainTests):
         self.assertEquals(response.status_code, 200)
         self.assert_('expected response' in response.content)
 
+    def test_two_legged_api_with_header(self):
+        request = oauth.Request.from_consumer_and_token(self.consumer, None, 'GET', self.two_legged_api_url, {'msg': 'expected response'})
+        request.sign_request(self.signature_method, self.consumer, None)
+        header = request.to_header(realm='TestApplication')['Authorization']
+
+        response = self.client.get(self.two_legged_api_url, {'msg': 'expected response'}, HTTP_AUTHORIZATION=header)
+        self.assertEquals(response.status_code, 200)
+        self.assert_('expected response' in response.content)
+
+    def test_forged_request_stores_no_nonce(self):
+        forged = oauth.Consumer(self.consumer.key, 'not the secret')
+        request = oauth.Request.from_consumer_and_token(forged, None, 'GET', self.two_legged_api_url, {'msg': 'forged'})
+        request.sign_request(self.signature_method, forged, None)
+
+        response = self.client.get(self.two_legged_api_url, request)
+        self.assertEquals(response.status_code, 401)
+        self.assertEquals(0, Nonce.objects.count())
+
+    def test_stale_request_stores_no_nonce(self):
+        request = oauth.Request.from_consumer_and_token(self.consumer, None, 'GET', self.two_legged_api_url,
+            {'msg': 'stale', 'oauth_timestamp': str(int(time.time()) - 3600)})
+        request.sign_request(self.signature_method, self.consumer, None)
+
+        response = self.client.get(self.two_legged_api_url, request)
+        self.assertEquals(response.status_code, 401)
+        self.assertEquals(0, Nonce.objects.count())
+
+    def test_oauth_client(self):
+        client = OAuthClient(self.consumer)
+
+        response = client.get('/api/oauth/two_legged_api', {'msg': 'expected response'})
+        self.assertEquals(response.status_code, 200)
+        self.assert_('expected response' in response.content)
+
+    def test_oauth_client_signs_form_put(self):
+        client = OAuthClient(self.consumer)
+
+        response = client.put('/api/oauth/two_legged_update', {'msg': 'updated'})
+        self.assertEquals(response.status_code, 200)
+        self.assert_('updated' in response.content)
+
+    def test_replay_fixture(self):
+        client = OAuthClient(self.consumer)
+
+        with frozen_time(1000000000):
+            fixture = client.record('GET', '/api/oauth/two_legged_api', {'msg': 'recorded response'})
+
+        response = OAuthClient().replay(fixture)
+        self.assertEquals(response.status_code, 200)
+        self.assert_('recorded response' in response.content)
+
+        response = OAuthClient().replay(fixture)
+        self.assertEquals(response.status_code, 401)
+
 
 class BasicAuthTest(MainTests):
 
@@ -299,6 +449,19 @@ class IncomingExpressiveTests(MainTests):
 
         self.assertEquals(result, expected)
 
+    def test_incoming_json_too_large(self):
+        from django.conf import settings
+
+        settings.PISTON_MAX_BODY_SIZE = 10
+        try:
+            resp = self.client.post('/api/expressive.json',
+                simplejson.dumps({'title': 'x' * 20}),
+                HTTP_AUTHORIZATION=self.auth_string,
+                content_type='application/json')
+            self.assertEquals(resp.status_code, 413)
+        finally:
+            del settings.PISTON_MAX_BODY_SIZE
+
     def test_incoming_invalid_json(self):
         resp = self.client.post('/api/expressive.json',
             'foo',
@@ -455,6 +618,212 @@ class ListFieldsTest(MainTests):
         self.assertEquals(resp.status_code, 200)
         self.assertEquals(resp.content, expect)
 
+class BulkTests(MainTests):
+    def test_bulk_create(self):
+        outgoing = simplejson.dumps([ {'name': 'a'}, {'name': 'b'}, {'bogus': 'c'} ])
+        resp = self.client.post('/api/bulk', outgoing, content_type='application/json')
+
+        self.assertEquals(resp.status_code, 201)
+        statuses = [ s['status'] for s in simplejson.loads(resp.content) ]
+        self.assertEquals([201, 201, 400], statuses)
+        self.assertEquals(['a', 'b'], sorted(BulkModel.objects.values_list('name', flat=True)))
+
+    def test_bulk_create_duplicate(self):
+        BulkModel.objects.create(name='a')
+        outgoing = simplejson.dumps([ {'name': 'a'}, {'name': 'b'} ])
+        resp = self.client.post('/api/bulk', outgoing, content_type='application/json')
+
+        self.assertEquals(resp.status_code, 409)
+        self.assertEquals(1, BulkModel.objects.count())
+
+    def test_bulk_update(self):
+        a = BulkModel.objects.create(name='a')
+        b = BulkModel.objects.create(name='b')
+        c = BulkModel.objects.create(name='c')
+        outgoing = simplejson.dumps([ {'id': a.pk, 'name': 'x'}, {'id': c.pk, 'name': 'z'},
+                                      {'id': 999, 'name': 'y'}, {'name': 'w'} ])
+        resp = self.client.put('/api/bulk', outgoing, content_type='application/json')
+
+        self.assertEquals(resp.status_code, 200)
+        statuses = [ s['status'] for s in simplejson.loads(resp.content) ]
+        self.assertEquals([200, 200, 404, 400], statuses)
+        self.assertEquals(['b', 'x', 'z'], sorted(BulkModel.objects.values_list('name', flat=True)))
+
+    def test_update_inherited_fields(self):
+        child = BulkChildModel.objects.create(name='a', size=1)
+        outgoing = simplejson.dumps({'name': 'b', 'size': 2})
+        resp = self.client.put('/api/bulk_child/%d' % child.pk, outgoing, content_type='application/json')
+
+        self.assertEquals(resp.status_code, 200)
+        child = BulkChildModel.objects.get(pk=child.pk)
+        self.assertEquals(('b', 2), (child.name, child.size))
+
+    def test_update_sends_signals_to_receivers(self):
+        from django.db.models.signals import post_save
+
+        saved = [ ]
+        def receiver(sender, instance, **kwargs):
+            saved.append(instance.name)
+
+        a = BulkModel.objects.create(name='a')
+        post_save.connect(receiver, sender=BulkModel)
+        try:
+            outgoing = simplejson.dumps({'name': 'b'})
+            resp = self.client.put('/api/bulk/%d' % a.pk, outgoing, content_type='application/json')
+        finally:
+            post_save.disconnect(receiver, sender=BulkModel)
+
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(['b'], saved)
+
+    def test_delete_with_empty_json_body(self):
+        a = BulkModel.objects.create(name='a')
+        resp = self.client.delete('/api/bulk/%d' % a.pk, CONTENT_TYPE='application/json')
+
+        self.assertEquals(resp.status_code, 204)
+        self.assertEquals(0, BulkModel.objects.count())
+
+    def test_bulk_delete(self):
+        from django.test.client import FakePayload
+
+        a = BulkModel.objects.create(name='a')
+        b = BulkModel.objects.create(name='b')
+        c = BulkModel.objects.create(name='c')
+        outgoing = simplejson.dumps([ a.pk, {'id': c.pk}, 999, [ b.pk ] ])
+        resp = self.client.delete('/api/bulk', **{
+            'wsgi.input': FakePayload(outgoing),
+            'CONTENT_LENGTH': len(outgoing),
+            'CONTENT_TYPE': 'application/json' })
+
+        self.assertEquals(resp.status_code, 200)
+        statuses = [ s['status'] for s in simplejson.loads(resp.content) ]
+        self.assertEquals([204, 204, 410, 400], statuses)
+        self.assertEquals([b.pk], list(BulkModel.objects.values_list('pk', flat=True)))
+
+class WriteTests(MainTests):
+    def test_create_duplicate(self):
+        resp = self.client.post('/api/bulk', {'name': 'a'})
+        self.assertEquals(resp.status_code, 200)
+
+        resp = self.client.post('/api/bulk', {'name': 'a'})
+        self.assertEquals(resp.status_code, 409)
+        self.assertEquals(1, BulkModel.objects.count())
+
+    def test_update(self):
+        from django.utils.http import urlencode
+
+        a = BulkModel.objects.create(name='a')
+        resp = self.client.put('/api/bulk/%d' % a.pk, urlencode({'name': 'x', 'bogus': 'y'}),
+            content_type='application/x-www-form-urlencoded')
+
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals('x', BulkModel.objects.get(pk=a.pk).name)
+
+    def test_update_not_found(self):
+        from django.utils.http import urlencode
+
+        resp = self.client.put('/api/bulk/999', urlencode({'name': 'x'}),
+            content_type='application/x-www-form-urlencoded')
+        self.assertEquals(resp.status_code, 404)
+
+class BatchTests(MainTests):
+    def init_delegate(self):
+        TestModel().save()
+
+    def test_batch(self):
+        outgoing = simplejson.dumps([
+            { 'path': '/api/entries/' },
+            { 'method': 'GET', 'path': '/api/echo?msg=hi' },
+            { 'path': '/api/nowhere' },
+            { 'method': 'POST', 'path': '/api/bulk', 'body': { 'name': 'n' } },
+            { 'method': 'POST', 'path': '/api/batch', 'body': [ ] },
+        ])
+        resp = self.client.post('/api/batch', outgoing, content_type='application/json',
+            HTTP_AUTHORIZATION=self.auth_string)
+        self.assertEquals(resp.status_code, 200)
+
+        result = simplejson.loads(resp.content)
+        self.assertEquals([200, 200, 404, 200, 400], [ r['status'] for r in result ])
+        self.assertEquals(1, len(result[0]['body']))
+        self.assertEquals({'msg': 'hi'}, result[1]['body'])
+        self.assertEquals(['n'], list(BulkModel.objects.values_list('name', flat=True)))
+
+    def test_batch_keeps_resource_authentication(self):
+        outgoing = simplejson.dumps([ { 'path': '/api/oauth/two_legged_api?msg=hi' } ])
+        resp = self.client.post('/api/batch', outgoing, content_type='application/json',
+            HTTP_AUTHORIZATION=self.auth_string)
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(401, simplejson.loads(resp.content)[0]['status'])
+
+    def test_batch_requires_authentication(self):
+        outgoing = simplejson.dumps([ { 'path': '/api/entries/' } ])
+        resp = self.client.post('/api/batch', outgoing, content_type='application/json')
+        self.assertEquals(resp.status_code, 401)
+
+class QueryTrackerTests(MainTests):
+    def init_delegate(self):
+        from test_project.apps.testapp.urls import expressive
+
+        for i in range(3):
+            em = ExpressiveTestModel(title="t%d" % i, content="c")
+            em.save()
+            Comment(parent=em, content="x").save()
+
+        self.resource = expressive
+        self.resource.query_sample_rate = 1
+        self.resource.query_threshold = 3
+
+    def tearDown(self):
+        self.resource.query_sample_rate = 0
+        self.resource.query_threshold = 5
+        super(QueryTrackerTests, self).tearDown()
+
+    def test_repeated_queries_are_reported(self):
+        from piston.signals import queries_counted
+
+        reports = [ ]
+        def receiver(sender, counts, repeated, **kwargs):
+            reports.append((counts, repeated))
+
+        queries_counted.connect(receiver)
+        try:
+            resp = self.client.get('/api/expressive.json',
+                HTTP_AUTHORIZATION=self.auth_string)
+        finally:
+            queries_counted.disconnect(receiver)
+
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(1, len(reports))
+
+        counts, repeated = reports[0]
+        self.assertEquals(4, counts['construct'])
+        self.assertEquals(1, len(repeated))
+
+        phase, shape, count, paths = repeated[0]
+        self.assertEquals(('construct', 3, ['comments']), (phase, count, paths))
+        self.assertTrue('= ?' in shape)
+
+    def test_finished_when_handler_raises(self):
+        from django.db import connection
+
+        def read(request, *args, **kwargs):
+            raise ZeroDivisionError()
+
+        handler = self.resource.handler
+        handler.read = read
+        display_errors, email_errors = self.resource.display_errors, self.resource.email_errors
+        self.resource.display_errors = self.resource.email_errors = False
+        debug_cursor = connection.use_debug_cursor
+
+        try:
+            self.assertRaises(ZeroDivisionError, self.client.get,
+                '/api/expressive.json', HTTP_AUTHORIZATION=self.auth_string)
+        finally:
+            del handler.read
+            self.resource.display_errors, self.resource.email_errors = display_errors, email_errors
+
+        self.assertEquals(debug_cursor, connection.use_debug_cursor)
+
 class ErrorHandlingTests(MainTests):
     """Test proper handling of errors by Resource"""
 
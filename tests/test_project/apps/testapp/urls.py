@@ -1,9 +1,10 @@
 from django.conf.urls.defaults import *
 from piston.resource import Resource
+from piston.batch import BatchHandler
 from piston.authentication import HttpBasicAuthentication, HttpBasicSimple
 from piston.authentication.oauth import OAuthAuthentication
 
-from test_project.apps.testapp.handlers import EntryHandler, ExpressiveHandler, AbstractHandler, EchoHandler, PlainOldObjectHandler, Issue58Handler, ListFieldsHandler
+from test_project.apps.testapp.handlers import EntryHandler, ExpressiveHandler, AbstractHandler, EchoHandler, EchoUpdateHandler, PlainOldObjectHandler, Issue58Handler, ListFieldsHandler, BulkHandler, BulkChildHandler
 
 auth = HttpBasicAuthentication(realm='TestApplication')
 
@@ -14,6 +15,9 @@ echo = Resource(handler=EchoHandler)
 popo = Resource(handler=PlainOldObjectHandler)
 list_fields = Resource(handler=ListFieldsHandler)
 issue58 = Resource(handler=Issue58Handler)
+bulk = Resource(handler=BulkHandler)
+bulk_child = Resource(handler=BulkChildHandler)
+batch = Resource(handler=BatchHandler, authentication=auth)
 
 AUTHENTICATORS = [auth,]
 SIMPLE_USERS = (('admin', 'secr3t'),
@@ -30,6 +34,7 @@ multiauth = Resource(handler=PlainOldObjectHandler,
 
 ouath_two_legged_api = Resource(handler=EchoHandler, authentication=OAuthAuthentication(realm='TestApplication', two_legged=True))
 ouath_three_legged_api = Resource(handler=EchoHandler, authentication=OAuthAuthentication(realm='TestApplication'))
+ouath_two_legged_update = Resource(handler=EchoUpdateHandler, authentication=OAuthAuthentication(realm='TestApplication', two_legged=True))
 
 urlpatterns = patterns('',
     url(r'^entries/$', entries),
@@ -52,11 +57,18 @@ urlpatterns = patterns('',
     url(r'^oauth/', include('piston.authentication.oauth.urls')),
     url(r'^oauth/two_legged_api$', ouath_two_legged_api),
     url(r'^oauth/three_legged_api$', ouath_three_legged_api),
+    url(r'^oauth/two_legged_update$', ouath_two_legged_update),
 
     url(r'^list_fields$', list_fields),
     url(r'^list_fields/(?P<id>.+)$', list_fields),
     
     url(r'^popo$', popo),
+
+    url(r'^bulk$', bulk),
+    url(r'^bulk/(?P<id>\d+)$', bulk),
+    url(r'^bulk_child/(?P<bulkmodel_ptr>\d+)$', bulk_child),
+
+    url(r'^batch$', batch),
 )
 
 